@@ -1,11 +1,41 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response, send_file, abort, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func, inspect
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 import werkzeug
+from werkzeug.datastructures import MultiDict
+import click
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
+import io
+import csv
+import time
+import threading
+import hashlib
+import json
+import math
 from functools import wraps
+from markupsafe import Markup
+from tasks import JobQueue, SMTPMailer, MemoryOutbox
+from batching import GroupCommitter
+from sqlalchemy.orm.exc import StaleDataError
+import signals
+from search_index import PrefixIndex
+from recommendations import TfidfModel
+from trending import TrendingLeaderboard
+from sitemap_xml import SitemapCache
+from profiler import SamplingProfiler
+from slow_queries import SlowQueryLog
+from backups import BackupManager
+from live_events import EventBroker, LocalBackend, SQLiteBackend
+import rich_text
+from page_cache import SingleFlightCache
+import service_worker
+from branches import BranchRouter, BranchSession, BranchInfo, branch_scoped, scoped_tables
+from read_models import row_type, fetch_rows, rows_to_json, to_json
+from catalog import ServiceCatalog, DoctorDirectory, PRICE_RANGES, DURATION_RANGES, WEEKDAYS
 
 # Проверяем версию и импортируем соответствующим образом
 if hasattr(werkzeug, '__version__') and werkzeug.__version__.startswith('3.'):
@@ -24,11 +54,88 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-change-in-production-1234567890'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///vetclinic.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Архив завершенных и отмененных записей - отдельный файл SQLite
+app.config['SQLALCHEMY_BINDS'] = {'archive': 'sqlite:///vetclinic_archive.db'}
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+# Уведомления: 'memory' - локальная заглушка вместо SMTP/SMS, 'smtp' - реальная отправка
+app.config['MAIL_BACKEND'] = os.environ.get('MAIL_BACKEND', 'memory')
+app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'localhost')
+app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 25))
+app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
+app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
+app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS') == '1'
+app.config['MAIL_SENDER'] = os.environ.get('MAIL_SENDER', 'noreply@vetclinic.ru')
+app.config['CLINIC_EMAIL'] = os.environ.get('CLINIC_EMAIL', 'info@vetclinic.ru')
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+# "Популярно сейчас": период полураспада просмотров и как часто перечитывать счетчики из БД
+app.config['TRENDING_HALF_LIFE_HOURS'] = 24
+app.config['TRENDING_RELOAD_SECONDS'] = 300
+# Запросы дольше порога попадают в журнал медленных запросов (/admin/slow-queries)
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 100))
+# Резервные копии: каталог, период в часах (0 - только вручную) и сколько хранить
+app.config['BACKUP_DIR'] = os.environ.get('BACKUP_DIR')
+app.config['BACKUP_INTERVAL_HOURS'] = float(os.environ.get('BACKUP_INTERVAL_HOURS', 6))
+app.config['BACKUP_KEEP_LAST'] = 3
+app.config['BACKUP_KEEP_DAILY'] = 7
+app.config['BACKUP_KEEP_WEEKLY'] = 4
+# Живые обновления панелей: 'local' - один процесс, 'sqlite' - несколько процессов на одной машине
+app.config['EVENTS_BACKEND'] = os.environ.get('EVENTS_BACKEND', 'local')
+app.config['SSE_HEARTBEAT_SECONDS'] = 15
+app.config['SSE_MAX_QUEUE'] = 100
+# Кэш готовых страниц для анонимных посетителей (главная, статьи), секунды
+app.config['PAGE_CACHE_SECONDS'] = int(os.environ.get('PAGE_CACHE_SECONDS', 60))
 
-db = SQLAlchemy(app)
+# Сессия сама выбирает базу филиала для его данных (см. branches.py)
+db = SQLAlchemy(app, session_options={'class_': BranchSession})
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Пожалуйста, войдите в систему для доступа к этой странице'
+
+# Очередь фоновых задач и каналы отправки уведомлений
+job_queue = JobQueue(os.path.join(app.instance_path, 'jobs.db'))
+if app.config['MAIL_BACKEND'] == 'smtp':
+    mailer = SMTPMailer(app.config['MAIL_SERVER'], app.config['MAIL_PORT'],
+                        username=app.config['MAIL_USERNAME'],
+                        password=app.config['MAIL_PASSWORD'],
+                        use_tls=app.config['MAIL_USE_TLS'],
+                        sender=app.config['MAIL_SENDER'])
+else:
+    mailer = MemoryOutbox()
+# SMS-шлюз пока не подключен - сообщения складываются в локальный outbox
+sms_gateway = MemoryOutbox()
+
+if app.config['EVENTS_BACKEND'] == 'sqlite':
+    events_backend = SQLiteBackend(os.path.join(app.instance_path, 'events.db'),
+                                   on_error=lambda e: app.logger.error('Опрос событий не удался: %s', e))
+else:
+    events_backend = LocalBackend()
+event_broker = EventBroker(events_backend, max_queue=app.config['SSE_MAX_QUEUE'])
+
+@signals.appointment_created.connect_via(app)
+def push_appointment_created(sender, appointment):
+    event_broker.publish('appointments', 'appointment_created', appointment)
+
+@signals.appointment_status_changed.connect_via(app)
+def push_appointment_status(sender, appointment, old_status):
+    event_broker.publish('appointments', 'appointment_status', dict(appointment, old_status=old_status))
+
+@job_queue.task('appointment_confirmation')
+def send_appointment_confirmation(payload):
+    text = (f"Здравствуйте, {payload['client_name']}!\n"
+            f"Вы записаны на прием {payload['date_time']}.\n"
+            f"Врач: {payload['doctor_name']}. Услуга: {payload['service_name']}.\n"
+            f"Питомец: {payload['pet_name']}.")
+    if payload.get('email'):
+        mailer.send(payload['email'], 'Запись в ветеринарную клинику "Друг"', text)
+    if payload.get('phone'):
+        sms_gateway.send(payload['phone'], 'Запись в клинику', text)
+
+@job_queue.task('contact_message')
+def deliver_contact_message(payload):
+    text = (f"Имя: {payload['name']}\nТелефон: {payload['phone']}\n"
+            f"Email: {payload['email']}\n\n{payload['message']}")
+    mailer.send(app.config['CLINIC_EMAIL'], 'Сообщение с сайта', text)
+
 # Модели БД
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -51,6 +158,12 @@ class Article(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_published = db.Column(db.Boolean, default=True)
     views = db.Column(db.Integer, default=0)
+    # Анонс и время чтения считаются при сохранении - спискам не нужен полный текст
+    excerpt = db.Column(db.String(300))
+    reading_time = db.Column(db.Integer)
+    # content - исходный Markdown, content_html - готовый безопасный HTML для страницы статьи
+    content_html = db.Column(db.Text)
+    content_hash = db.Column(db.String(64))
 
 class News(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -59,7 +172,66 @@ class News(db.Model):
     author_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_published = db.Column(db.Boolean, default=True)
+    excerpt = db.Column(db.String(300))
+    reading_time = db.Column(db.Integer)
+    content_html = db.Column(db.Text)
+    content_hash = db.Column(db.String(64))
+
+EXCERPT_LENGTH = 200
+WORDS_PER_MINUTE = 180
+
+def make_excerpt(text, length=EXCERPT_LENGTH):
+    """Начало текста без переносов, обрезанное по границе слова"""
+    text = ' '.join((text or '').split())
+    if len(text) <= length:
+        return text
+    return text[:length].rsplit(' ', 1)[0].rstrip(',.;:-—') + '…'
+
+def reading_minutes(text):
+    return max(1, round(len((text or '').split()) / WORDS_PER_MINUTE))
+
+def render_content(target):
+    """Пересчитывает HTML, анонс и время чтения, если текст или версия рендера изменились.
+
+    Вызывается только при записи (события before_insert/before_update и
+    команда render-content после смены версии рендера) - чтение ничего не пишет.
+    """
+    digest = rich_text.content_hash(target.content)
+    if target.content_hash == digest:
+        return False
+    text = rich_text.plain_text(target.content)
+    target.content_html = rich_text.render(target.content)
+    target.content_hash = digest
+    target.excerpt = make_excerpt(text)
+    target.reading_time = reading_minutes(text)
+    return True
+
+def content_html(item):
+    """Готовый HTML текста; строки, еще не обработанные render-content, рендерятся на лету без записи в базу"""
+    return item.content_html if item.content_html is not None else rich_text.render(item.content)
+
+def update_text_summary(mapper, connection, target):
+    # При обновлении пересчитываем, только если менялся текст (а не, например, счетчик просмотров)
+    if target.content_hash is None or inspect(target).attrs.content.history.has_changes():
+        render_content(target)
+
+for _model in (Article, News):
+    event.listen(_model, 'before_insert', update_text_summary)
+    event.listen(_model, 'before_update', update_text_summary)
+
+# Филиалы клиники. database - адрес базы филиала (SQLite-путь относительно instance);
+# пустой - филиал хранит данные в основной базе
+class Branch(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    slug = db.Column(db.String(50), unique=True, nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    address = db.Column(db.String(200))
+    phone = db.Column(db.String(20))
+    database = db.Column(db.String(300))
+    is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+@branch_scoped
 class Service(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -68,6 +240,7 @@ class Service(db.Model):
     category = db.Column(db.String(50))
     duration = db.Column(db.String(20))
 
+@branch_scoped
 class Doctor(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -78,20 +251,655 @@ class Doctor(db.Model):
     photo_url = db.Column(db.String(300))
     schedule = db.Column(db.Text)
 
+class Pet(db.Model):
+    __table_args__ = (
+        db.Index('ix_pet_owner_name_species', 'owner_id', 'name', 'species'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    name = db.Column(db.String(50), nullable=False)
+    species = db.Column(db.String(30))
+    # Храним год рождения, а не возраст - возраст не устаревает
+    birth_year = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    owner = db.relationship('User', backref='pets')
+    
+    @property
+    def age(self):
+        if self.birth_year is None:
+            return None
+        return datetime.today().year - self.birth_year
+
+def normalize_pet_name(name):
+    return ' '.join((name or '').split()).capitalize()
+
+def find_or_create_pet(owner_id, name, species, age=None, on_date=None):
+    """Питомец клиента по (владелец, имя, вид); при первой записи создается"""
+    name = normalize_pet_name(name)
+    species = (species or '').strip().lower() or None
+    pet = Pet.query.filter_by(owner_id=owner_id, name=name, species=species).first()
+    birth_year = None
+    if age not in (None, ''):
+        birth_year = (on_date or datetime.today()).year - int(age)
+    if pet is None:
+        pet = Pet(owner_id=owner_id, name=name, species=species, birth_year=birth_year)
+        db.session.add(pet)
+    elif birth_year is not None:
+        pet.birth_year = birth_year
+    return pet
+
+@branch_scoped
 class Appointment(db.Model):
+    __table_args__ = (
+        db.Index('ix_appointment_doctor_date_time', 'doctor_id', 'date_time'),
+        db.Index('ix_appointment_date_time', 'date_time'),
+        db.Index('ix_appointment_pet_date_time', 'pet_id', 'date_time'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     client_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'))
-    service_id = db.Column(db.Integer, db.ForeignKey('service.id'))
+    # active_history: агрегатам отчетов нужно прежнее значение, даже если атрибут
+    # после commit устарел и не загружен (иначе изменение вычлось бы из новой строки)
+    doctor_id = db.column_property(db.Column(db.Integer, db.ForeignKey('doctor.id')), active_history=True)
+    service_id = db.column_property(db.Column(db.Integer, db.ForeignKey('service.id')), active_history=True)
+    pet_id = db.Column(db.Integer, db.ForeignKey('pet.id'))
+    # pet_name/pet_species/pet_age - снимок на момент записи, основная карточка в Pet
     pet_name = db.Column(db.String(50))
     pet_species = db.Column(db.String(30))
     pet_age = db.Column(db.Integer)
-    date_time = db.Column(db.DateTime, nullable=False)
-    status = db.Column(db.String(20), default='pending')
+    date_time = db.column_property(db.Column(db.DateTime, nullable=False), active_history=True)
+    status = db.column_property(db.Column(db.String(20), default='pending'), active_history=True)
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Номер версии для оптимистичной блокировки: UPDATE ... WHERE version = <прочитанная>
+    version = db.Column(db.Integer, nullable=False, default=1)
     doctor = db.relationship('Doctor', backref='appointments')
     service = db.relationship('Service', backref='appointments')
+    pet = db.relationship('Pet', backref=db.backref('appointments', lazy='dynamic'))
+    
+    __mapper_args__ = {'version_id_col': version}
+    
+    def to_event(self):
+        return {
+            'id': self.id,
+            'doctor_id': int(self.doctor_id) if self.doctor_id else None,
+            'service_id': int(self.service_id) if self.service_id else None,
+            'client_id': self.client_id,
+            'date_time': self.date_time.isoformat() if self.date_time else None,
+            'status': self.status,
+            'version': self.version,
+            'branch': branch_router.current().slug
+        }
+
+# Записи старше ARCHIVE_AFTER_DAYS в конечных статусах переносятся в архивную базу.
+# Внешних ключей нет (другой файл БД), связи с врачом/услугой/питомцем - только для чтения.
+# У дополнительных филиалов архив лежит в базе филиала
+@branch_scoped
+class ArchivedAppointment(db.Model):
+    __bind_key__ = 'archive'
+    __tablename__ = 'archived_appointment'
+    __table_args__ = (
+        db.Index('ix_archived_appointment_client_date_time', 'client_id', 'date_time'),
+        db.Index('ix_archived_appointment_pet_date_time', 'pet_id', 'date_time'),
+        db.Index('ix_archived_appointment_date_time', 'date_time'),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    client_id = db.Column(db.Integer)
+    doctor_id = db.Column(db.Integer)
+    service_id = db.Column(db.Integer)
+    pet_id = db.Column(db.Integer)
+    pet_name = db.Column(db.String(50))
+    pet_species = db.Column(db.String(30))
+    pet_age = db.Column(db.Integer)
+    date_time = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20))
+    notes = db.Column(db.Text)
+    created_at = db.Column(db.DateTime)
+    version = db.Column(db.Integer)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    doctor = db.relationship('Doctor', primaryjoin='foreign(ArchivedAppointment.doctor_id) == Doctor.id', viewonly=True)
+    service = db.relationship('Service', primaryjoin='foreign(ArchivedAppointment.service_id) == Service.id', viewonly=True)
+    pet = db.relationship('Pet', primaryjoin='foreign(ArchivedAppointment.pet_id) == Pet.id', viewonly=True)
+
+ARCHIVABLE_STATUSES = ('completed', 'cancelled', 'no_show')
+
+def _branch_appointment_history(criteria, since):
+    # Врач и услуга загружаются сразу: после fan_out объекты уже без сессии
+    live = Appointment.query.options(db.selectinload(Appointment.doctor), db.selectinload(Appointment.service)) \
+        .filter(*criteria(Appointment))
+    if since is not None:
+        live = live.filter(Appointment.date_time >= since)
+    result = live.all()
+    horizon = datetime.now() - timedelta(days=app.config['ARCHIVE_AFTER_DAYS'])
+    if since is None or since < horizon:
+        archived = ArchivedAppointment.query.options(db.selectinload(ArchivedAppointment.doctor),
+                                                     db.selectinload(ArchivedAppointment.service)) \
+            .filter(*criteria(ArchivedAppointment))
+        if since is not None:
+            archived = archived.filter(ArchivedAppointment.date_time >= since)
+        result += archived.all()
+    return result
+
+def appointment_history(criteria, since=None):
+    """Записи из рабочей и архивной таблиц всех филиалов, новые сверху; у каждой - атрибут branch.
+
+    criteria - функция (модель) -> список условий; вызывается в потоках филиалов,
+    поэтому не должна обращаться к current_user и request. Архив читается, только
+    если запрошенный период (since) заходит за горизонт архивации.
+    """
+    result = []
+    for branch, appointments in branch_router.fan_out(lambda branch: _branch_appointment_history(criteria, since)):
+        for appointment in appointments:
+            appointment.branch = branch
+        result += appointments
+    result.sort(key=lambda a: a.date_time, reverse=True)
+    return result
+
+# Допустимые переходы статусов: действие -> (из каких статусов, в какой)
+APPOINTMENT_TRANSITIONS = {
+    'confirm': (('pending',), 'confirmed'),
+    'cancel': (('pending', 'confirmed'), 'cancelled'),
+    'complete': (('pending', 'confirmed'), 'completed'),
+    'no_show': (('pending', 'confirmed'), 'no_show'),
+}
+
+# Сводка записей на день по каждому врачу (материализуется при каждом flush)
+@branch_scoped
+class DoctorDaySummary(db.Model):
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    pending = db.Column(db.Integer, nullable=False, default=0)
+    confirmed = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    cancelled = db.Column(db.Integer, nullable=False, default=0)
+    no_show = db.Column(db.Integer, nullable=False, default=0)
+    first_at = db.Column(db.DateTime)
+    last_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+def _appointment_day_keys(appointment):
+    """Пары (врач, день), которых касается изменение записи - текущие и прежние значения"""
+    state = inspect(appointment)
+    doctors = {appointment.doctor_id}
+    dates = {appointment.date_time}
+    doctors.update(state.attrs.doctor_id.history.deleted)
+    dates.update(state.attrs.date_time.history.deleted)
+    keys = set()
+    for doctor_id in doctors:
+        for date_time in dates:
+            if doctor_id in (None, '') or date_time is None:
+                continue
+            keys.add((int(doctor_id), date_time.date()))
+    return keys
+
+def _day_status_counts(connection, model, doctor_id, start, end):
+    return connection.execute(
+        db.select(model.status, func.count(), func.min(model.date_time), func.max(model.date_time))
+        .where(model.doctor_id == doctor_id, model.date_time >= start, model.date_time < end)
+        .group_by(model.status)
+    ).all()
+
+def refresh_day_summaries(connection, keys, archive_connection=None):
+    """Пересчитывает сводки по индексу (doctor_id, date_time) для указанных дней.
+
+    archive_connection - учесть и архивные записи (при полном пересчете).
+    """
+    table = DoctorDaySummary.__table__
+    for doctor_id, day in keys:
+        start = datetime.combine(day, datetime.min.time())
+        end = start + timedelta(days=1)
+        rows = _day_status_counts(connection, Appointment, doctor_id, start, end)
+        if archive_connection is not None:
+            rows += _day_status_counts(archive_connection, ArchivedAppointment, doctor_id, start, end)
+        connection.execute(table.delete().where(table.c.doctor_id == doctor_id, table.c.day == day))
+        if not rows:
+            continue
+        summary = {'doctor_id': doctor_id, 'day': day, 'total': 0, 'pending': 0, 'confirmed': 0,
+                   'completed': 0, 'cancelled': 0, 'no_show': 0, 'first_at': None, 'last_at': None,
+                   'updated_at': datetime.utcnow()}
+        for status, count, first_at, last_at in rows:
+            summary['total'] += count
+            if status in ('pending', 'confirmed', 'completed', 'cancelled', 'no_show'):
+                summary[status] += count
+            if summary['first_at'] is None or first_at < summary['first_at']:
+                summary['first_at'] = first_at
+            if summary['last_at'] is None or last_at > summary['last_at']:
+                summary['last_at'] = last_at
+        connection.execute(table.insert(), summary)
+
+@event.listens_for(db.session, 'after_flush')
+def update_agenda_summaries(session, flush_context):
+    keys = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Appointment):
+            keys |= _appointment_day_keys(obj)
+    if keys:
+        refresh_day_summaries(session.connection(bind_arguments={'mapper': Appointment}), keys)
+
+# Отчеты: ежедневные агрегаты, обновляемые приращениями в той же транзакции,
+# что и сами данные. Отсутствующий врач/услуга хранится как 0.
+@branch_scoped
+class DailyAppointmentStat(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    doctor_id = db.Column(db.Integer, primary_key=True, default=0)
+    service_id = db.Column(db.Integer, primary_key=True, default=0)
+    status = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+class DailySiteStat(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    new_users = db.Column(db.Integer, nullable=False, default=0)
+    article_views = db.Column(db.Integer, nullable=False, default=0)
+
+def _service_prices(connection, service_ids):
+    ids = [i for i in service_ids if i]
+    if not ids:
+        return {}
+    rows = connection.execute(db.select(Service.id, Service.price).where(Service.id.in_(ids))).all()
+    return {row.id: row.price or 0 for row in rows}
+
+def apply_appointment_deltas(connection, deltas):
+    """deltas: {(day, doctor_id, service_id, status): +-count}"""
+    deltas = {key: value for key, value in deltas.items() if value}
+    if not deltas:
+        return
+    prices = _service_prices(connection, {key[2] for key in deltas})
+    table = DailyAppointmentStat.__table__
+    for (day, doctor_id, service_id, status), count in deltas.items():
+        revenue = count * prices.get(service_id, 0)
+        stmt = sqlite_insert(table).values(day=day, doctor_id=doctor_id, service_id=service_id,
+                                           status=status, count=count, revenue=revenue)
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=['day', 'doctor_id', 'service_id', 'status'],
+            set_={'count': table.c.count + count, 'revenue': table.c.revenue + revenue}
+        ))
+        # Запись ушла из статуса - строка, где счетчик дошел до нуля, отчетам не нужна
+        if count < 0:
+            connection.execute(table.delete().where(
+                table.c.day == day, table.c.doctor_id == doctor_id, table.c.service_id == service_id,
+                table.c.status == status, table.c.count == 0))
+
+def apply_site_deltas(connection, deltas):
+    """deltas: {(day, column): +-count}, column - new_users или article_views"""
+    table = DailySiteStat.__table__
+    for (day, column), count in deltas.items():
+        if not count:
+            continue
+        values = {'day': day, 'new_users': 0, 'article_views': 0}
+        values[column] = count
+        stmt = sqlite_insert(table).values(**values)
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=['day'], set_={column: table.c[column] + count}
+        ))
+
+def _rollup_key(doctor_id, service_id, date_time, status):
+    return (date_time.date(), int(doctor_id or 0), int(service_id or 0), status or 'pending')
+
+def _old_value(state, attr):
+    history = state.attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.object, attr)
+
+@event.listens_for(db.session, 'after_flush')
+def update_report_rollups(session, flush_context):
+    appointment_deltas = {}
+    site_deltas = {}
+    
+    def add(deltas, key, value):
+        deltas[key] = deltas.get(key, 0) + value
+    
+    for obj in session.new:
+        if isinstance(obj, Appointment) and obj.date_time:
+            add(appointment_deltas, _rollup_key(obj.doctor_id, obj.service_id, obj.date_time, obj.status), 1)
+        elif isinstance(obj, User):
+            add(site_deltas, ((obj.created_at or datetime.utcnow()).date(), 'new_users'), 1)
+    
+    for obj in session.dirty:
+        state = inspect(obj)
+        if isinstance(obj, Appointment) and obj.date_time:
+            if not any(state.attrs[a].history.has_changes()
+                       for a in ('doctor_id', 'service_id', 'date_time', 'status')):
+                continue
+            old = _rollup_key(*(_old_value(state, a) for a in ('doctor_id', 'service_id', 'date_time', 'status')))
+            add(appointment_deltas, old, -1)
+            add(appointment_deltas, _rollup_key(obj.doctor_id, obj.service_id, obj.date_time, obj.status), 1)
+        elif isinstance(obj, Article):
+            history = state.attrs.views.history
+            if history.deleted and history.added:
+                add(site_deltas, (datetime.utcnow().date(), 'article_views'),
+                    (history.added[0] or 0) - (history.deleted[0] or 0))
+    
+    for obj in session.deleted:
+        if isinstance(obj, Appointment) and obj.date_time:
+            state = inspect(obj)
+            old = _rollup_key(*(_old_value(state, a) for a in ('doctor_id', 'service_id', 'date_time', 'status')))
+            add(appointment_deltas, old, -1)
+    
+    # Агрегаты записей лежат в базе филиала, статистика сайта - в основной
+    if appointment_deltas:
+        apply_appointment_deltas(session.connection(bind_arguments={'mapper': Appointment}), appointment_deltas)
+    if site_deltas:
+        apply_site_deltas(session.connection(), site_deltas)
+
+# Индекс подсказок поиска (в памяти процесса). Изменения моделей копятся
+# во время flush и применяются к индексу только после успешного коммита.
+suggest_index = PrefixIndex()
+_suggest_lock = threading.Lock()
+_suggest_built = False
+
+def _suggest_item(obj):
+    """(тип, id, заголовок, вес) для индекса или (тип, id, None, 0) - убрать из индекса"""
+    if isinstance(obj, Article):
+        title = obj.title if obj.is_published is not False else None
+        return ('article', obj.id, title, obj.views or 0)
+    if isinstance(obj, News):
+        return ('news', obj.id, obj.title if obj.is_published is not False else None, 0)
+    # Услуги и врачи в подсказках - основного филиала (id в базах филиалов пересекаются)
+    if isinstance(obj, (Service, Doctor)) and not branch_router.is_default():
+        return None
+    if isinstance(obj, Service):
+        return ('service', obj.id, obj.name, 0)
+    if isinstance(obj, Doctor):
+        return ('doctor', obj.id, obj.name, 0)
+    return None
+
+def _catalog_names():
+    return db.session.query(Service.id, Service.name).all(), db.session.query(Doctor.id, Doctor.name).all()
+
+def build_suggest_index():
+    global _suggest_built
+    with _suggest_lock:
+        if _suggest_built:
+            return
+        items = [('article', row.id, row.title, row.views or 0) for row in
+                 db.session.query(Article.id, Article.title, Article.views).filter(Article.is_published == True)]
+        items += [('news', row.id, row.title, 0) for row in
+                  db.session.query(News.id, News.title).filter(News.is_published == True)]
+        services, doctors = branch_router.run(branch_router.default(), _catalog_names)
+        items += [('service', row.id, row.name, 0) for row in services]
+        items += [('doctor', row.id, row.name, 0) for row in doctors]
+        # Одна сортировка вместо вставки каждого ключа в середину массива
+        suggest_index.build(items)
+        _suggest_built = True
+
+@event.listens_for(db.session, 'after_flush')
+def collect_suggest_changes(session, flush_context):
+    changes = session.info.setdefault('suggest_changes', {})
+    for obj in list(session.new) + list(session.dirty):
+        item = _suggest_item(obj)
+        if item:
+            changes[item[:2]] = item
+    for obj in session.deleted:
+        item = _suggest_item(obj)
+        if item:
+            changes[item[:2]] = (item[0], item[1], None, 0)
+
+@event.listens_for(db.session, 'after_commit')
+def apply_suggest_changes(session):
+    changes = session.info.pop('suggest_changes', None)
+    if not changes or not _suggest_built:
+        return
+    for kind, item_id, title, weight in changes.values():
+        if title:
+            suggest_index.add(kind, item_id, title, weight)
+        else:
+            suggest_index.remove(kind, item_id)
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_suggest_changes(session):
+    session.info.pop('suggest_changes', None)
+
+# Похожие статьи: top-N соседей по TF-IDF, пересчитываются фоновой задачей
+SIMILAR_ARTICLES_COUNT = 5
+# Сколько секунд ждать перед пересчетом похожих статей, собирая правки в одну задачу
+SIMILAR_REFRESH_DELAY = 10
+
+class ArticleSimilarity(db.Model):
+    __table_args__ = (
+        db.Index('ix_article_similarity_article_rank', 'article_id', 'rank'),
+    )
+    article_id = db.Column(db.Integer, db.ForeignKey('article.id'), primary_key=True)
+    similar_id = db.Column(db.Integer, db.ForeignKey('article.id'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+    rank = db.Column(db.Integer, nullable=False)
+
+def load_tfidf_model():
+    rows = db.session.query(Article.id, Article.title, Article.content) \
+        .filter(Article.is_published == True).yield_per(500)
+    return TfidfModel(rows)
+
+def store_similar_articles(connection, neighbours):
+    """neighbours: {article_id: [(similar_id, score), ...]} - заменяет строки этих статей"""
+    table = ArticleSimilarity.__table__
+    ids = list(neighbours)
+    for i in range(0, len(ids), 500):
+        connection.execute(table.delete().where(table.c.article_id.in_(ids[i:i + 500])))
+    rows = [{'article_id': article_id, 'similar_id': similar_id, 'score': score, 'rank': rank}
+            for article_id, items in neighbours.items()
+            for rank, (similar_id, score) in enumerate(items)]
+    if rows:
+        connection.execute(table.insert(), rows)
+
+@job_queue.task('refresh_similar_articles')
+def refresh_similar_articles(payload):
+    with app.app_context():
+        model = load_tfidf_model()
+        changed = set(payload['article_ids'])
+        affected = set(changed)
+        # Ближайшие кандидаты измененной статьи и те, кто на нее уже ссылался
+        for article_id in changed:
+            affected.update(other_id for other_id, _ in model.neighbours(article_id, 50))
+        affected.update(row[0] for row in db.session.query(ArticleSimilarity.article_id)
+                        .filter(ArticleSimilarity.similar_id.in_(changed)))
+        store_similar_articles(db.session.connection(), {
+            article_id: model.neighbours(article_id, SIMILAR_ARTICLES_COUNT) for article_id in affected
+        })
+        db.session.commit()
+
+@event.listens_for(db.session, 'after_flush')
+def collect_article_changes(session, flush_context):
+    changed = session.info.setdefault('changed_articles', set())
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, Article):
+            changed.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, Article):
+            state = inspect(obj)
+            if any(state.attrs[a].history.has_changes() for a in ('title', 'content', 'is_published')):
+                changed.add(obj.id)
+
+def _merge_article_ids(queued, new):
+    return {'article_ids': sorted(set(queued['article_ids']) | set(new['article_ids']))}
+
+@event.listens_for(db.session, 'after_commit')
+def schedule_similar_articles(session):
+    changed = session.info.pop('changed_articles', None)
+    if changed:
+        # Каждый пересчет читает все статьи, поэтому правки за несколько секунд
+        # сливаются в одну ожидающую задачу, а не ставят по пересчету на каждую
+        job_queue.enqueue_coalesced('refresh_similar_articles', {'article_ids': sorted(changed)},
+                                    merge=_merge_article_ids, delay=SIMILAR_REFRESH_DELAY)
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_article_changes(session):
+    session.info.pop('changed_articles', None)
+
+# Просмотры статей по часам - из них строится рейтинг "популярно сейчас"
+class ArticleViewBucket(db.Model):
+    article_id = db.Column(db.Integer, db.ForeignKey('article.id'), primary_key=True)
+    hour = db.Column(db.DateTime, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+trending = TrendingLeaderboard(half_life=app.config['TRENDING_HALF_LIFE_HOURS'] * 3600, size=10)
+
+def _trending_meta(article):
+    return {'title': article.title, 'image_url': article.image_url, 'category': article.category}
+
+def record_article_view(article):
+    """Добавляет просмотр в часовой счетчик (в текущей транзакции)"""
+    table = ArticleViewBucket.__table__
+    hour = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    stmt = sqlite_insert(table).values(article_id=article.id, hour=hour, count=1)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['article_id', 'hour'], set_={'count': table.c.count + 1}
+    ))
+
+def load_trending():
+    """Перечитывает рейтинг из часовых счетчиков, если он устарел (просмотры других процессов)"""
+    if trending.loaded_at and time.time() - trending.loaded_at < app.config['TRENDING_RELOAD_SECONDS']:
+        return
+    # Дальше 10 периодов полураспада вклад просмотров меньше 0.1%
+    since = datetime.utcnow() - timedelta(hours=app.config['TRENDING_HALF_LIFE_HOURS'] * 10)
+    rows = db.session.query(ArticleViewBucket.article_id, ArticleViewBucket.hour, ArticleViewBucket.count,
+                            Article.title, Article.image_url, Article.category) \
+        .join(Article, Article.id == ArticleViewBucket.article_id) \
+        .filter(ArticleViewBucket.hour >= since, Article.is_published == True).all()
+    epoch = datetime(1970, 1, 1)
+    now = time.time()
+    # Просмотры часа считаем пришедшимися на его середину (но не позже текущего момента)
+    events = [
+        (row.article_id, row.count, min((row.hour - epoch).total_seconds() + 1800, now),
+         {'title': row.title, 'image_url': row.image_url, 'category': row.category})
+        for row in rows
+    ]
+    trending.replace(events, now=now)
+
+def get_trending_articles(limit=3):
+    load_trending()
+    return [dict(meta, id=article_id, score=round(score, 3))
+            for article_id, score, meta in trending.top(limit)]
+
+# Кэши в памяти процесса, которые сбрасываются после коммита изменений соответствующих моделей
+model_cache_invalidators = {}
+
+def invalidates_on(*model_names):
+    def decorator(func):
+        for name in model_names:
+            model_cache_invalidators.setdefault(name, []).append(func)
+        return func
+    return decorator
+
+@event.listens_for(db.session, 'after_flush')
+def collect_changed_models(session, flush_context):
+    changed = session.info.setdefault('changed_models', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        changed.add(type(obj).__name__)
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_model_caches(session):
+    for name in session.info.pop('changed_models', ()):
+        for invalidate in model_cache_invalidators.get(name, ()):
+            invalidate()
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_changed_models(session):
+    session.info.pop('changed_models', None)
+
+def load_branches():
+    rows = db.session.query(Branch.id, Branch.slug, Branch.name, Branch.address, Branch.phone, Branch.database) \
+        .filter(Branch.is_active == True).order_by(Branch.id).all()
+    return [BranchInfo(*row) for row in rows]
+
+# Филиал запроса выбирается до первого обращения к данным: ?branch=<slug> или выбранный ранее
+branch_router = BranchRouter(app, load_branches, on_engine=lambda engine: slow_query_log.install(engine))
+invalidates_on('Branch')(branch_router.invalidate)
+
+@app.before_request
+def select_branch():
+    branch = branch_router.get(request.args.get('branch') or session.get('branch'))
+    branch_router.activate(branch or branch_router.default())
+
+# Каталог услуг и справочник врачей - свои у каждого филиала
+service_catalogs = {}
+doctor_directories = {}
+
+@invalidates_on('Service')
+def invalidate_service_catalogs():
+    for catalog in service_catalogs.values():
+        catalog.invalidate()
+
+@invalidates_on('Doctor')
+def invalidate_doctor_directories():
+    for directory in doctor_directories.values():
+        directory.invalidate()
+
+def get_service_catalog():
+    slug = branch_router.current().slug
+    if slug not in service_catalogs:
+        service_catalogs[slug] = ServiceCatalog()
+    service_catalog = service_catalogs[slug]
+    if service_catalog.is_stale():
+        service_catalog.load(db.session.query(
+            Service.id, Service.name, Service.description, Service.price, Service.category, Service.duration
+        ).order_by(Service.id))
+    return service_catalog
+
+def get_doctor_directory():
+    slug = branch_router.current().slug
+    if slug not in doctor_directories:
+        doctor_directories[slug] = DoctorDirectory()
+    doctor_directory = doctor_directories[slug]
+    if doctor_directory.is_stale():
+        doctor_directory.load(db.session.query(
+            Doctor.id, Doctor.name, Doctor.specialization, Doctor.experience, Doctor.photo_url, Doctor.schedule
+        ).order_by(Doctor.id))
+    return doctor_directory
+
+def busy_minutes_by_doctor(day):
+    """Занятые минуты дня по врачам - один агрегирующий запрос по индексу date_time.
+    В пределах запроса (например, частей /api/batch) результат переиспользуется."""
+    cache = g.setdefault('busy_minutes', {})
+    if day not in cache:
+        cache[day] = _busy_minutes_by_doctor(day)
+    return cache[day]
+
+def _busy_minutes_by_doctor(day):
+    start = datetime.combine(day, datetime.min.time())
+    minutes = (func.cast(func.strftime('%H', Appointment.date_time), db.Integer) * 60
+               + func.cast(func.strftime('%M', Appointment.date_time), db.Integer))
+    rows = db.session.query(Appointment.doctor_id, func.group_concat(minutes)) \
+        .filter(Appointment.date_time >= start,
+                Appointment.date_time < start + timedelta(days=1),
+                Appointment.doctor_id.isnot(None),
+                Appointment.status.notin_(['cancelled', 'no_show'])) \
+        .group_by(Appointment.doctor_id).all()
+    return {doctor_id: {int(m) for m in str(values).split(',')} for doctor_id, values in rows}
+
+# Строки для страниц-списков: только нужные столбцы, без ORM-объектов
+ArticleListRow = row_type('ArticleListRow', Article.id, Article.title, Article.excerpt, Article.reading_time,
+                          Article.category, Article.image_url, Article.views, Article.created_at)
+NewsListRow = row_type('NewsListRow', News.id, News.title, News.excerpt, News.reading_time, News.created_at)
+DoctorListRow = row_type('DoctorListRow', Doctor.id, Doctor.name, Doctor.specialization, Doctor.experience,
+                         Doctor.education, Doctor.bio, Doctor.photo_url, Doctor.schedule)
+
+def json_response(text, status=200):
+    """Ответ с уже сериализованным JSON (см. read_models.rows_to_json)"""
+    return Response(text, status=status, mimetype='application/json')
+
+CONTACT_MESSAGE_STATUSES = ('new', 'handled', 'spam')
+
+class ContactMessage(db.Model):
+    __table_args__ = (
+        db.Index('ix_contact_message_status_id', 'status', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100))
+    phone = db.Column(db.String(20))
+    email = db.Column(db.String(120))
+    message = db.Column(db.Text)
+    status = db.Column(db.String(20), nullable=False, default='new')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    handled_at = db.Column(db.DateTime)
+    handled_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+
+def _write_contact_messages(rows):
+    with db.engine.begin() as conn:
+        conn.execute(ContactMessage.__table__.insert(), rows)
+
+# Сообщения с формы контактов пишутся пачками: один INSERT и один коммит на группу запросов
+contact_inbox = GroupCommitter(_write_contact_messages)
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
@@ -132,60 +940,163 @@ def inject_base_template():
     return dict(
         base_template=base_template,
         is_accessible=is_accessible,
-        current_style=style
+        current_style=style,
+        show_images=images_enabled(),
+        branches=branch_router.all(),
+        current_branch=branch_router.current()
     )
 
+def images_enabled():
+    """В версии для слабовидящих картинки не отдаются, пока пользователь сам их не включит"""
+    accessible = session.get('style') == 'accessible' or session.get('accessible', False)
+    return not accessible or session.get('accessible_images', False)
+
+@app.template_global()
+def image(src, alt='', **attrs):
+    """<img> или, без картинок, текстовая замена - браузер вообще не скачивает файл"""
+    if not images_enabled():
+        return Markup('<span class="image-replacement" role="img" aria-label="{0}">[ИЗОБРАЖЕНИЕ: {0}]</span>').format(
+            alt or 'без описания')
+    html = Markup('<img src="{}" alt="{}"').format(src, alt)
+    for name, value in attrs.items():
+        # class - зарезервированное слово, в шаблоне передается как class_
+        html += Markup(' {}="{}"').format(name.rstrip('_').replace('_', '-'), value)
+    return html + Markup('>')
+
+# Профилировщик выключен по умолчанию, включается администратором через /admin/profiler
+profiler = SamplingProfiler()
+
+@app.before_request
+def start_profiling():
+    if profiler.should_profile(request.path):
+        g.profile_token = profiler.start(request.endpoint)
+
+@app.teardown_request
+def stop_profiling(exc):
+    token = g.pop('profile_token', None)
+    if token is not None:
+        profiler.stop(token)
+
+slow_query_log = SlowQueryLog(threshold_ms=app.config['SLOW_QUERY_MS'])
+with app.app_context():
+    # Основная база и архив (bind 'archive'); базы филиалов подключаются при создании движка (on_engine)
+    for _engine in db.engines.values():
+        slow_query_log.install(_engine, lambda: request.endpoint if has_request_context() else None)
+
+def backup_databases():
+    """Файлы всех баз SQLite для резервной копии: основная, архив и базы филиалов"""
+    with app.app_context():
+        engines = {'main' if key is None else key: engine for key, engine in db.engines.items()}
+        for branch in branch_router.all():
+            if branch.database:
+                engines['branch-' + branch.slug] = branch_router.engine(branch.database)
+    paths = {}
+    for label, engine in engines.items():
+        path = engine.url.database
+        if engine.url.drivername.startswith('sqlite') and path not in (None, '', ':memory:') \
+                and path not in paths.values():
+            paths[label] = path
+    return paths
+
+backup_manager = BackupManager(backup_databases,
+                               app.config['BACKUP_DIR'] or os.path.join(app.instance_path, 'backups'),
+                               keep_last=app.config['BACKUP_KEEP_LAST'],
+                               keep_daily=app.config['BACKUP_KEEP_DAILY'],
+                               keep_weekly=app.config['BACKUP_KEEP_WEEKLY'])
+
+def start_backup_schedule():
+    if app.config['BACKUP_INTERVAL_HOURS'] > 0:
+        backup_manager.start(app.config['BACKUP_INTERVAL_HOURS'] * 3600,
+                             on_error=lambda e: app.logger.error('Резервное копирование не удалось: %s', e))
+
+page_cache = SingleFlightCache(os.path.join(app.instance_path, 'page_cache'), ttl=app.config['PAGE_CACHE_SECONDS'])
+invalidates_on('Article', 'News', 'Service', 'Doctor')(page_cache.invalidate)
+
+def cached_page(name, render):
+    """Страница из общего кэша; для вошедших пользователей и при флеш-сообщениях - всегда заново"""
+    if app.config['PAGE_CACHE_SECONDS'] <= 0 or current_user.is_authenticated or session.get('_flashes'):
+        return render()
+    # Вариант страницы зависит от филиала и оформления (обычное/для слабовидящих, с картинками или без).
+    # В ключ идут только значения из конечного набора - не строки из сессии как есть
+    accessible = session.get('style') == 'accessible' or bool(session.get('accessible'))
+    key = f"{name}-{branch_router.current().slug}-{int(accessible)}-{int(images_enabled())}"
+    return page_cache.get(key, render)
+
 # Основные маршруты
 @app.route('/')
 def index():
-    news = News.query.filter_by(is_published=True).order_by(News.created_at.desc()).limit(3).all()
-    services = Service.query.limit(3).all()
-    doctors = Doctor.query.limit(3).all()
-    return render_template('index.html', news=news, services=services, doctors=doctors)
+    def render():
+        news = News.query.options(db.defer(News.content)).filter_by(is_published=True) \
+            .order_by(News.created_at.desc()).limit(3).all()
+        services = Service.query.limit(3).all()
+        doctors = Doctor.query.limit(3).all()
+        return render_template('index.html', news=news, services=services, doctors=doctors,
+                               trending_articles=get_trending_articles(3))
+    return cached_page('index', render)
 
 @app.route('/services')
 def services():
-    services_list = Service.query.all()
-    categories = db.session.query(Service.category).distinct().all()
-    return render_template('services.html', services=services_list, categories=categories)
+    catalog = get_service_catalog()
+    services_list, _, _ = catalog.query()
+    return render_template('services.html', services=services_list, categories=catalog.categories)
 
 @app.route('/doctors')
 def doctors():
-    doctors_list = Doctor.query.all()
-    specializations = db.session.query(Doctor.specialization).distinct().all()
+    doctors_list = fetch_rows(db.session, DoctorListRow, order_by=Doctor.id)
+    specializations = get_doctor_directory().specializations
     return render_template('doctors.html', doctors=doctors_list, specializations=specializations)
 @app.route('/articles')
 def articles():
-    articles_list = Article.query.filter_by(is_published=True).order_by(Article.created_at.desc()).all()
-    
-    # Получаем уникальные категории из статей
-    categories_query = db.session.query(Article.category).filter(Article.category.isnot(None)).distinct().all()
-    categories = [cat[0] for cat in categories_query if cat[0]]  # Извлекаем строки из кортежей
-    
-    return render_template('articles.html', articles=articles_list, categories=categories)
+    def render():
+        articles_list = fetch_rows(db.session, ArticleListRow, Article.is_published == True,
+                                   order_by=Article.created_at.desc())
+        
+        # Получаем уникальные категории из статей
+        categories_query = db.session.query(Article.category).filter(Article.category.isnot(None)).distinct().all()
+        categories = [cat[0] for cat in categories_query if cat[0]]  # Извлекаем строки из кортежей
+        
+        return render_template('articles.html', articles=articles_list, categories=categories)
+    return cached_page('articles', render)
 
 @app.route('/article/<int:article_id>')
 def article_detail(article_id):
     article = Article.query.get_or_404(article_id)
-    article.views += 1
+    # Счетчик увеличивается в SQL, без пометки статьи измененной - иначе каждый
+    # просмотр сбрасывал бы кэш страниц со списками статей
+    Article.query.filter_by(id=article.id).update({Article.views: Article.views + 1},
+                                                  synchronize_session='evaluate')
+    # Мимо истории атрибута views - поэтому просмотр учитывается в отчетах здесь же, в той же транзакции
+    apply_site_deltas(db.session.connection(), {(datetime.utcnow().date(), 'article_views'): 1})
+    record_article_view(article)
     db.session.commit()
+    trending.record(article.id, meta=_trending_meta(article))
     
-    # Похожие статьи
-    similar_articles = Article.query.filter(
-        Article.category == article.category,
-        Article.id != article.id,
+    # Похожие статьи - заранее посчитанные соседи по содержанию
+    similar_articles = Article.query.join(
+        ArticleSimilarity, ArticleSimilarity.similar_id == Article.id
+    ).filter(
+        ArticleSimilarity.article_id == article.id,
         Article.is_published == True
-    ).limit(3).all()
+    ).order_by(ArticleSimilarity.rank).limit(3).all()
+    
+    if not similar_articles:
+        # Соседи еще не посчитаны - статьи той же категории
+        similar_articles = Article.query.filter(
+            Article.category == article.category,
+            Article.id != article.id,
+            Article.is_published == True
+        ).order_by(Article.views.desc()).limit(3).all()
     
-    return render_template('article_detail.html', article=article, similar_articles=similar_articles)
+    return render_template('article_detail.html', article=article, content_html=content_html(article),
+                           similar_articles=similar_articles,
+                           trending_articles=get_trending_articles(3))
     
 @app.route('/articles/category/<category_name>')
 def articles_by_category(category_name):
-    # Получаем статьи по категории
-    articles_list = Article.query.filter_by(
-        category=category_name, 
-        is_published=True
-    ).order_by(Article.created_at.desc()).all()
+    # Получаем статьи по категории - только поля карточки списка, без текста статьи
+    articles_list = fetch_rows(db.session, ArticleListRow,
+                               Article.category == category_name, Article.is_published == True,
+                               order_by=Article.created_at.desc())
     
     # Получаем все категории для фильтра
     all_categories = db.session.query(Article.category).distinct().all()
@@ -204,34 +1115,161 @@ def contacts():
         email = request.form.get('email')
         message = request.form.get('message')
         
-        # Здесь можно добавить отправку email или сохранение в БД
+        contact_inbox.add({
+            'name': name,
+            'phone': phone,
+            'email': email,
+            'message': message,
+            'status': 'new'
+        })
+        
+        # Письмо в клинику уходит в фоне, запрос не ждет SMTP
+        job_queue.enqueue('contact_message', {
+            'name': name,
+            'phone': phone,
+            'email': email,
+            'message': message
+        })
         flash('Ваше сообщение отправлено! Мы свяжемся с вами в ближайшее время.', 'success')
         return redirect(url_for('contacts'))
     
     return render_template('contacts.html')
 
+def get_contact_messages(status=None, before_id=None, limit=50):
+    """Страница входящих сообщений: keyset-пагинация по id (новые сверху)"""
+    query = ContactMessage.query
+    if status:
+        query = query.filter(ContactMessage.status == status)
+    if before_id:
+        query = query.filter(ContactMessage.id < before_id)
+    return query.order_by(ContactMessage.id.desc()).limit(limit).all()
+
+@app.route('/staff/messages')
+@staff_required
+def staff_messages():
+    status = request.args.get('status', 'new')
+    if status not in CONTACT_MESSAGE_STATUSES:
+        status = None
+    before_id = request.args.get('before', type=int)
+    limit = min(request.args.get('limit', 50, type=int), 200)
+    messages = get_contact_messages(status, before_id, limit)
+    next_before = messages[-1].id if len(messages) == limit else None
+    
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'messages': [{
+                'id': m.id,
+                'name': m.name,
+                'phone': m.phone,
+                'email': m.email,
+                'message': m.message,
+                'status': m.status,
+                'created_at': m.created_at.isoformat() if m.created_at else None
+            } for m in messages],
+            'next_before': next_before
+        })
+    
+    return render_template('messages.html',
+                           inbox=messages,
+                           status=status,
+                           statuses=CONTACT_MESSAGE_STATUSES,
+                           next_before=next_before)
+
+@app.route('/staff/messages/mark', methods=['POST'])
+@staff_required
+def mark_messages():
+    new_status = request.form.get('status', 'handled')
+    if new_status not in CONTACT_MESSAGE_STATUSES:
+        flash('Неизвестный статус сообщения', 'danger')
+        return redirect(url_for('staff_messages'))
+    
+    ids = request.form.getlist('ids', type=int)
+    # up_to - обработать все сообщения текущего фильтра с id <= up_to
+    up_to = request.form.get('up_to', type=int)
+    from_status = request.form.get('from_status')
+    values = {
+        'status': new_status,
+        'handled_at': datetime.utcnow() if new_status != 'new' else None,
+        'handled_by': current_user.id if new_status != 'new' else None
+    }
+    
+    updated = 0
+    if up_to:
+        query = ContactMessage.query.filter(ContactMessage.id <= up_to)
+        if from_status in CONTACT_MESSAGE_STATUSES:
+            query = query.filter(ContactMessage.status == from_status)
+        updated = query.update(values, synchronize_session=False)
+    else:
+        # Пачками, чтобы не упереться в лимит параметров SQLite
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            updated += ContactMessage.query.filter(ContactMessage.id.in_(chunk)).update(
+                values, synchronize_session=False)
+    db.session.commit()
+    
+    flash(f'Обновлено сообщений: {updated}', 'success')
+    return redirect(request.referrer or url_for('staff_messages'))
+
 @app.route('/news')
 def news():
-    news_list = News.query.filter_by(is_published=True).order_by(News.created_at.desc()).all()
-    return render_template('news.html', news=news_list)
+    news_list = fetch_rows(db.session, NewsListRow, News.is_published == True, order_by=News.created_at.desc())
+    # ?open=<id> - полный текст новости прямо в странице (для браузеров без JavaScript)
+    opened = None
+    open_id = request.args.get('open', type=int)
+    if open_id:
+        item = db.session.execute(
+            db.select(News.id, News.content, News.content_html).where(News.id == open_id, News.is_published == True)
+        ).first()
+        if item is not None:
+            opened = {'id': item.id, 'content_html': content_html(item)}
+    return render_template('news.html', news=news_list, opened=opened)
+
+@app.route('/api/news/<int:news_id>')
+def api_news_item(news_id):
+    """Полный текст новости - подгружается при раскрытии на странице /news"""
+    item = db.session.execute(
+        db.select(News.id, News.title, News.content, News.content_html)
+        .where(News.id == news_id, News.is_published == True)
+    ).first()
+    if item is None:
+        abort(404)
+    return jsonify({'id': item.id, 'title': item.title, 'content_html': content_html(item)})
+
+def day_appointments(day):
+    return Appointment.query.options(
+        db.selectinload(Appointment.client), db.selectinload(Appointment.doctor), db.selectinload(Appointment.service)
+    ).filter(
+        Appointment.date_time >= datetime.combine(day, datetime.min.time()),
+        Appointment.date_time <= datetime.combine(day, datetime.max.time())
+    ).order_by(Appointment.date_time).all()
+
+def branch_day_overview(day):
+    """Записи филиала на день и общее число записей филиала (с архивом)"""
+    return day_appointments(day), Appointment.query.count() + ArchivedAppointment.query.count()
 
 @app.route('/profile')
 @login_required
 def profile():
     if current_user.role == 'client':
-        appointments = Appointment.query.filter_by(client_id=current_user.id).order_by(Appointment.date_time.desc()).all()
-        return render_template('profile.html', appointments=appointments)
+        client_id = current_user.id
+        appointments = appointment_history(lambda model: [model.client_id == client_id])
+        pets = Pet.query.filter_by(owner_id=current_user.id).order_by(Pet.name).all()
+        return render_template('profile.html', appointments=appointments, pets=pets)
     elif current_user.role in ['staff', 'admin']:
         # Для сотрудников и администраторов
         today = datetime.today().date()
-        appointments = Appointment.query.filter(
-            Appointment.date_time >= datetime.combine(today, datetime.min.time()),
-            Appointment.date_time <= datetime.combine(today, datetime.max.time())
-        ).order_by(Appointment.date_time).all()
         
         if current_user.role == 'admin':
+            # Администратор видит все филиалы: по потоку на базу филиала, результаты сливаются
+            appointments = []
+            appointments_count = 0
+            for branch, (rows, count) in branch_router.fan_out(lambda branch: branch_day_overview(today)):
+                for appointment in rows:
+                    appointment.branch = branch
+                appointments += rows
+                appointments_count += count
+            appointments.sort(key=lambda a: a.date_time)
             users_count = User.query.count()
-            appointments_count = Appointment.query.count()
             users = User.query.order_by(User.created_at.desc()).all()
             return render_template('admin_panel.html', 
                                  appointments=appointments,
@@ -239,7 +1277,7 @@ def profile():
                                  appointments_count=appointments_count,
                                  users=users)
         
-        return render_template('profile.html', appointments=appointments)
+        return render_template('profile.html', appointments=day_appointments(today))
               
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -336,7 +1374,10 @@ def register_staff():
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('index'))
+    response = redirect(url_for('index'))
+    # Страницы из кэшей браузера (в том числе service worker) могли показывать данные пользователя
+    response.headers['Clear-Site-Data'] = '"cache"'
+    return response
 
 @app.route('/make-appointment', methods=['POST'])
 @login_required
@@ -353,10 +1394,18 @@ def make_appointment():
     try:
         date_time = datetime.strptime(f'{appointment_date} {appointment_time}', '%Y-%m-%d %H:%M')
         
+        pet = None
+        pet_id = request.form.get('pet_id', type=int)
+        if pet_id:
+            pet = Pet.query.filter_by(id=pet_id, owner_id=current_user.id).first()
+        if pet is None:
+            pet = find_or_create_pet(current_user.id, pet_name, pet_species, pet_age, date_time)
+        
         appointment = Appointment(
             client_id=current_user.id,
             doctor_id=doctor_id,
             service_id=service_id,
+            pet=pet,
             pet_name=pet_name,
             pet_species=pet_species,
             pet_age=pet_age,
@@ -367,6 +1416,18 @@ def make_appointment():
         
         db.session.add(appointment)
         db.session.commit()
+        signals.appointment_created.send(app, appointment=appointment.to_event())
+        
+        job_queue.enqueue('appointment_confirmation', {
+            'appointment_id': appointment.id,
+            'client_name': current_user.full_name or current_user.username,
+            'email': current_user.email,
+            'phone': current_user.phone,
+            'date_time': date_time.strftime('%d.%m.%Y %H:%M'),
+            'doctor_name': appointment.doctor.name if appointment.doctor else '-',
+            'service_name': appointment.service.name if appointment.service else '-',
+            'pet_name': pet_name
+        })
         
         flash('Запись успешно создана! Ожидайте подтверждения от клиники.', 'success')
     except Exception as e:
@@ -378,12 +1439,13 @@ def make_appointment():
 def search():
     query = request.args.get('q', '')
     if query:
-        articles = Article.query.filter(
+        # Текст участвует в условии, но в результаты не загружается - показываем анонс
+        articles = Article.query.options(db.defer(Article.content)).filter(
             (Article.title.contains(query)) | 
             (Article.content.contains(query))
         ).filter_by(is_published=True).all()
         
-        news_items = News.query.filter(
+        news_items = News.query.options(db.defer(News.content)).filter(
             (News.title.contains(query)) | 
             (News.content.contains(query))
         ).filter_by(is_published=True).all()
@@ -403,15 +1465,155 @@ def search():
                          news=news_items, 
                          services=services)
 
+@app.route('/api/suggest')
+def api_suggest():
+    """Подсказки для строки поиска из префиксного индекса в памяти"""
+    build_suggest_index()
+    limit = max(1, min(request.args.get('limit', 8, type=int), 20))
+    results = suggest_index.search(request.args.get('q', ''), limit)
+    for item in results:
+        if item['type'] == 'article':
+            item['url'] = url_for('article_detail', article_id=item['id'])
+        elif item['type'] == 'news':
+            item['url'] = url_for('news')
+        elif item['type'] == 'service':
+            item['url'] = url_for('services')
+        else:
+            item['url'] = url_for('doctors')
+    return jsonify(results)
+
+@app.route('/api/trending')
+def api_trending():
+    limit = max(1, min(request.args.get('limit', 10, type=int), trending.size))
+    articles = get_trending_articles(limit)
+    for item in articles:
+        item['url'] = url_for('article_detail', article_id=item['id'])
+    return jsonify(articles)
+
+SITE_STYLES = ('default', 'accessible')
+
 @app.route('/switch-style/<style_name>')
 def switch_style(style_name):
-    session['style'] = style_name
+    session['style'] = style_name if style_name in SITE_STYLES else 'default'
+    return redirect(request.referrer or url_for('index'))
+
+@app.route('/branch/<slug>')
+def switch_branch(slug):
+    if branch_router.get(slug) is None:
+        abort(404)
+    session['branch'] = slug
     return redirect(request.referrer or url_for('index'))
 
 @app.route('/sitemap')
 def sitemap():
     return render_template('sitemap.html')
 
+sitemap_cache = SitemapCache(os.path.join(app.instance_path, 'sitemaps'))
+_sitemap_checked = {'at': 0, 'version': None}
+
+def sitemap_version():
+    """Отпечаток набора URL: меняется при добавлении, удалении и снятии с публикации"""
+    if time.time() - _sitemap_checked['at'] < 60 and _sitemap_checked['version']:
+        return _sitemap_checked['version']
+    parts = [
+        db.session.query(func.count(Article.id), func.max(Article.id), func.max(Article.created_at),
+                         func.count(Article.category.distinct())).filter(Article.is_published == True).one(),
+        db.session.query(func.count(News.id), func.max(News.created_at)).filter(News.is_published == True).one(),
+        db.session.query(func.count(Doctor.id), func.max(Doctor.id)).one(),
+        db.session.query(func.count(Service.id), func.max(Service.id)).one(),
+    ]
+    version = hashlib.md5(repr([tuple(row) for row in parts]).encode()).hexdigest()
+    _sitemap_checked.update(at=time.time(), version=version)
+    return version
+
+def sitemap_urls():
+    """(адрес, lastmod) всех публичных страниц; статьи читаются из БД порциями"""
+    last_news = db.session.query(func.max(News.created_at)).filter(News.is_published == True).scalar()
+    last_article = db.session.query(func.max(Article.created_at)).filter(Article.is_published == True).scalar()
+    yield url_for('index', _external=True), last_news
+    yield url_for('services', _external=True), None
+    yield url_for('doctors', _external=True), None
+    yield url_for('news', _external=True), last_news
+    yield url_for('articles', _external=True), last_article
+    yield url_for('contacts', _external=True), None
+    yield url_for('sitemap', _external=True), None
+    
+    categories = db.session.query(Article.category, func.max(Article.created_at)) \
+        .filter(Article.is_published == True, Article.category.isnot(None)) \
+        .group_by(Article.category).order_by(Article.category)
+    for category, lastmod in categories.yield_per(1000):
+        yield url_for('articles_by_category', category_name=category, _external=True), lastmod
+    
+    articles = db.session.query(Article.id, Article.created_at) \
+        .filter(Article.is_published == True).order_by(Article.id)
+    for article_id, created_at in articles.yield_per(1000):
+        yield url_for('article_detail', article_id=article_id, _external=True), created_at
+
+def ensure_sitemap():
+    sitemap_cache.ensure(sitemap_version(), sitemap_urls,
+                         lambda n: url_for('sitemap_part', number=n, _external=True))
+
+@app.route('/sitemap.xml')
+def sitemap_xml():
+    ensure_sitemap()
+    return send_file(sitemap_cache.path('sitemap.xml'), mimetype='application/xml', max_age=3600)
+
+@app.route('/sitemap-<int:number>.xml')
+def sitemap_part(number):
+    ensure_sitemap()
+    path = sitemap_cache.path(f'sitemap-{number}.xml')
+    if not os.path.exists(path):
+        abort(404)
+    return send_file(path, mimetype='application/xml', max_age=3600)
+
+@app.route('/robots.txt')
+def robots_txt():
+    lines = [
+        'User-agent: *',
+        'Disallow: /profile',
+        'Disallow: /admin/',
+        'Disallow: /staff/',
+        'Disallow: /api/',
+        'Disallow: /login',
+        'Disallow: /register',
+        'Disallow: /search',
+        f"Sitemap: {url_for('sitemap_xml', _external=True)}",
+    ]
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain')
+
+# Service worker: какие страницы отдавать из кэша, а какие - только свежими из сети
+SERVICE_WORKER_SHELL = ['/', '/contacts', '/services', '/doctors', '/articles', '/news']
+SERVICE_WORKER_SWR = ['/', '/articles', '/article/', '/news', '/services', '/doctors', '/contacts', '/sitemap']
+SERVICE_WORKER_NETWORK_FIRST = ['/api/']
+# Личные страницы: не кэшируются ни service worker, ни браузером, ни прокси
+SERVICE_WORKER_PRIVATE = ['/profile', '/staff/', '/admin/']
+SERVICE_WORKER_RESET = ['/login', '/logout', '/register', '/toggle-accessible', '/toggle-images', '/switch-style/',
+                        '/branch/']
+_service_worker = {}
+
+@app.after_request
+def private_pages_no_store(response):
+    if request.path.startswith(tuple(SERVICE_WORKER_PRIVATE)):
+        response.headers['Cache-Control'] = 'private, no-store'
+    return response
+
+@app.route('/sw.js')
+def service_worker_js():
+    """Сгенерированный service worker; версия кэшей меняется вместе со статикой и шаблонами"""
+    if 'script' not in _service_worker:
+        manifest = service_worker.build_manifest(app.static_folder, app.static_url_path,
+                                                 os.path.join(app.root_path, app.template_folder),
+                                                 SERVICE_WORKER_SHELL)
+        _service_worker['version'] = manifest['version']
+        _service_worker['script'] = service_worker.render(
+            manifest, SERVICE_WORKER_SWR, SERVICE_WORKER_NETWORK_FIRST, SERVICE_WORKER_PRIVATE,
+            SERVICE_WORKER_RESET, '/contacts')
+    response = Response(_service_worker['script'], mimetype='application/javascript')
+    # Браузер должен проверять sw.js при каждом заходе, иначе новая версия не установится
+    response.headers['Cache-Control'] = 'no-cache'
+    response.set_etag(_service_worker['version'])
+    return response.make_conditional(request)
+
 @app.route('/toggle-accessible')
 def toggle_accessible():
     if 'accessible' not in session:
@@ -425,40 +1627,970 @@ def toggle_accessible():
             session['style'] = 'default'  # или удаляем session['style']
     return redirect(request.referrer or url_for('index'))
 
+@app.route('/toggle-images')
+def toggle_images():
+    session['accessible_images'] = not session.get('accessible_images', False)
+    return redirect(request.referrer or url_for('index'))
+
+@app.route('/api/appointments/<int:appointment_id>/<action>', methods=['POST'])
+@staff_required
+def change_appointment_status(appointment_id, action):
+    """Переход статуса записи. Клиент передает version, которую видел - при расхождении 409"""
+    if action not in APPOINTMENT_TRANSITIONS:
+        return jsonify({'error': 'Неизвестное действие'}), 400
+    allowed_from, new_status = APPOINTMENT_TRANSITIONS[action]
+    data = request.get_json(silent=True) or request.form.to_dict()
+    expected_version = data.get('version')
+    if expected_version not in (None, ''):
+        try:
+            expected_version = int(expected_version)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Неверная версия записи'}), 400
+    
+    appointment = Appointment.query.get_or_404(appointment_id)
+    if expected_version not in (None, '') and expected_version != appointment.version:
+        return jsonify({'error': 'Запись уже изменена другим сотрудником',
+                        'appointment': appointment.to_event()}), 409
+    if appointment.status not in allowed_from:
+        return jsonify({'error': f'Нельзя выполнить {action} из статуса {appointment.status}',
+                        'appointment': appointment.to_event()}), 409
+    
+    old_status = appointment.status
+    appointment.status = new_status
+    try:
+        db.session.commit()
+    except StaleDataError:
+        # Между чтением и записью строку успел изменить кто-то еще
+        db.session.rollback()
+        appointment = Appointment.query.get(appointment_id)
+        return jsonify({'error': 'Запись уже изменена другим сотрудником',
+                        'appointment': appointment.to_event() if appointment else None}), 409
+    
+    event_data = appointment.to_event()
+    signals.appointment_status_changed.send(app, appointment=event_data, old_status=old_status)
+    return jsonify({'appointment': event_data})
+
+@app.route('/api/appointments/bulk/<action>', methods=['POST'])
+@staff_required
+def bulk_change_appointment_status(action):
+    """Массовый переход: по списку ids или по дате (например, подтвердить все ожидающие за сегодня)"""
+    if action not in APPOINTMENT_TRANSITIONS:
+        return jsonify({'error': 'Неизвестное действие'}), 400
+    allowed_from, new_status = APPOINTMENT_TRANSITIONS[action]
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids') or request.form.getlist('ids', type=int)
+    day = data.get('date') or request.form.get('date')
+    
+    # Один UPDATE с проверкой статуса: строки, которые кто-то уже перевел, просто не попадут
+    condition = [Appointment.status.in_(allowed_from)]
+    if ids:
+        # Строка "123" тоже итерируется - по символам, как ids 1, 2, 3
+        if not isinstance(ids, list):
+            return jsonify({'error': 'ids должен быть списком'}), 400
+        try:
+            ids = [int(i) for i in ids]
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Неверный список ids'}), 400
+        condition.append(Appointment.id.in_(ids))
+    elif day:
+        try:
+            start = datetime.strptime(day, '%Y-%m-%d')
+        except ValueError:
+            return jsonify({'error': 'Неверный формат даты'}), 400
+        condition.append(Appointment.date_time >= start)
+        condition.append(Appointment.date_time < start + timedelta(days=1))
+    else:
+        return jsonify({'error': 'Нужно указать ids или date'}), 400
+    
+    # old_status для каждой строки нужен для событий
+    old_statuses = dict(db.session.query(Appointment.id, Appointment.status).filter(*condition).all())
+    changed = db.session.execute(
+        db.update(Appointment)
+        .where(*condition, Appointment.id.in_(list(old_statuses)))
+        .values(status=new_status, version=Appointment.version + 1)
+        .returning(Appointment.id, Appointment.doctor_id, Appointment.service_id,
+                   Appointment.client_id, Appointment.date_time, Appointment.version),
+        execution_options={'synchronize_session': False}
+    ).all()
+    keys = {(row.doctor_id, row.date_time.date()) for row in changed if row.doctor_id}
+    connection = db.session.connection(bind_arguments={'mapper': Appointment})
+    refresh_day_summaries(connection, keys)
+    deltas = {}
+    for row in changed:
+        for status, sign in ((old_statuses.get(row.id), -1), (new_status, 1)):
+            key = _rollup_key(row.doctor_id, row.service_id, row.date_time, status)
+            deltas[key] = deltas.get(key, 0) + sign
+    apply_appointment_deltas(connection, deltas)
+    db.session.commit()
+    
+    events = []
+    for row in changed:
+        event_data = {
+            'id': row.id,
+            'doctor_id': row.doctor_id,
+            'service_id': row.service_id,
+            'client_id': row.client_id,
+            'date_time': row.date_time.isoformat(),
+            'status': new_status,
+            'version': row.version,
+            'branch': branch_router.current().slug
+        }
+        signals.appointment_status_changed.send(app, appointment=event_data,
+                                                old_status=old_statuses.get(row.id))
+        events.append(event_data)
+    return jsonify({'updated': len(events), 'appointments': events})
+
+@app.route('/api/pets')
+@login_required
+def api_pets():
+    pets = Pet.query.filter_by(owner_id=current_user.id).order_by(Pet.name).all()
+    return jsonify([{
+        'id': pet.id,
+        'name': pet.name,
+        'species': pet.species,
+        'age': pet.age
+    } for pet in pets])
+
+@app.route('/api/pets/<int:pet_id>/history')
+@login_required
+def api_pet_history(pet_id):
+    """История посещений питомца во всех филиалах - по индексу (pet_id, date_time) в каждой базе"""
+    pet = Pet.query.get_or_404(pet_id)
+    if pet.owner_id != current_user.id and current_user.role not in ['admin', 'staff']:
+        return jsonify({'error': 'Нет доступа'}), 403
+    visits = appointment_history(lambda model: [model.pet_id == pet_id])
+    return jsonify({
+        'pet': {'id': pet.id, 'name': pet.name, 'species': pet.species, 'age': pet.age},
+        'visits': [{
+            'id': a.id,
+            'date_time': a.date_time.isoformat(),
+            'status': a.status,
+            'branch': a.branch.name,
+            'doctor': a.doctor.name if a.doctor else None,
+            'service': a.service.name if a.service else None,
+            'notes': a.notes
+        } for a in visits]
+    })
+
+@app.route('/api/events')
+@staff_required
+def api_events():
+    """Поток событий по записям для открытых панелей сотрудников (text/event-stream)"""
+    stream = event_broker.stream(['appointments'], heartbeat=app.config['SSE_HEARTBEAT_SECONDS'])
+    return Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Не буферизовать поток на прокси (nginx)
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/agenda')
+@staff_required
+def api_agenda():
+    """Расписание врачей на день/неделю из таблицы сводок; details=1 добавляет сами записи"""
+    try:
+        start = datetime.strptime(request.args.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        start = datetime.today().date()
+    days = max(1, min(request.args.get('days', 1, type=int), 31))
+    end = start + timedelta(days=days)
+    doctor_id = request.args.get('doctor_id', type=int)
+    
+    query = DoctorDaySummary.query.filter(DoctorDaySummary.day >= start, DoctorDaySummary.day < end)
+    if doctor_id:
+        query = query.filter(DoctorDaySummary.doctor_id == doctor_id)
+    summaries = query.order_by(DoctorDaySummary.day, DoctorDaySummary.doctor_id).all()
+    
+    result = {
+        'from': start.isoformat(),
+        'to': (end - timedelta(days=1)).isoformat(),
+        'days': [{
+            'doctor_id': row.doctor_id,
+            'date': row.day.isoformat(),
+            'total': row.total,
+            'pending': row.pending,
+            'confirmed': row.confirmed,
+            'completed': row.completed,
+            'cancelled': row.cancelled,
+            'no_show': row.no_show,
+            'first_at': row.first_at.strftime('%H:%M') if row.first_at else None,
+            'last_at': row.last_at.strftime('%H:%M') if row.last_at else None
+        } for row in summaries]
+    }
+    
+    if request.args.get('details') == '1':
+        appointments = Appointment.query.filter(
+            Appointment.date_time >= datetime.combine(start, datetime.min.time()),
+            Appointment.date_time < datetime.combine(end, datetime.min.time())
+        )
+        if doctor_id:
+            appointments = appointments.filter(Appointment.doctor_id == doctor_id)
+        appointments = appointments.options(
+            # Клиенты - в основной базе, а не в базе филиала: отдельным запросом, не JOIN
+            db.selectinload(Appointment.client), db.selectinload(Appointment.service)
+        ).order_by(Appointment.date_time).all()
+        result['appointments'] = [{
+            'id': a.id,
+            'doctor_id': a.doctor_id,
+            'date_time': a.date_time.isoformat(),
+            'status': a.status,
+            'pet_name': a.pet_name,
+            'client': a.client.full_name if a.client else None,
+            'service': a.service.name if a.service else None
+        } for a in appointments]
+    
+    return jsonify(result)
+
+REPORT_PERIODS = {'day': '%Y-%m-%d', 'month': '%Y-%m', 'year': '%Y'}
+
+@app.route('/admin/reports')
+@admin_required
+def admin_reports():
+    """Отчет по записям из ежедневных агрегатов (сырые записи не сканируются).
+    По всем филиалам параллельно с суммированием; branch=<slug> - только один филиал."""
+    today = datetime.today().date()
+    try:
+        date_from = datetime.strptime(request.args.get('from', ''), '%Y-%m-%d').date()
+    except ValueError:
+        date_from = today.replace(day=1)
+    try:
+        date_to = datetime.strptime(request.args.get('to', ''), '%Y-%m-%d').date()
+    except ValueError:
+        date_to = today
+    period = request.args.get('period', 'day')
+    if period not in REPORT_PERIODS:
+        period = 'day'
+    by = request.args.get('by')
+    
+    period_col = func.strftime(REPORT_PERIODS[period], DailyAppointmentStat.day).label('period')
+    columns = [period_col]
+    if by == 'doctor':
+        columns.append(DailyAppointmentStat.doctor_id.label('doctor_id'))
+    elif by == 'service':
+        columns.append(DailyAppointmentStat.service_id.label('service_id'))
+    elif by == 'status':
+        columns.append(DailyAppointmentStat.status.label('status'))
+    else:
+        by = None
+    # Выручку считаем только по завершенным приемам
+    revenue = func.sum(db.case((DailyAppointmentStat.status == 'completed', DailyAppointmentStat.revenue),
+                               else_=0)).label('revenue')
+    
+    def branch_rows(branch):
+        return db.session.query(*columns, func.sum(DailyAppointmentStat.count).label('appointments'), revenue) \
+            .filter(DailyAppointmentStat.day >= date_from, DailyAppointmentStat.day <= date_to) \
+            .group_by(*columns).having(func.sum(DailyAppointmentStat.count) != 0).all()
+    
+    only = branch_router.get(request.args.get('branch'))
+    merged = {}
+    for branch, rows in branch_router.fan_out(branch_rows, [only] if only else None):
+        for row in rows:
+            item = row._asdict()
+            # id врачей и услуг в каждом филиале свои - такие строки между филиалами не складываются
+            if by in ('doctor', 'service'):
+                item = dict(period=item.pop('period'), branch=branch.slug, **item)
+            key = tuple(value for name, value in item.items() if name not in ('appointments', 'revenue'))
+            if key in merged:
+                merged[key]['appointments'] += item['appointments']
+                merged[key]['revenue'] = (merged[key]['revenue'] or 0) + (item['revenue'] or 0)
+            else:
+                merged[key] = item
+    
+    site_period = func.strftime(REPORT_PERIODS[period], DailySiteStat.day)
+    site_rows = dict(
+        (row[0], (row[1], row[2])) for row in db.session.query(
+            site_period, func.sum(DailySiteStat.new_users), func.sum(DailySiteStat.article_views))
+        .filter(DailySiteStat.day >= date_from, DailySiteStat.day <= date_to)
+        .group_by(site_period).all()
+    )
+    
+    report = []
+    for key in sorted(merged):
+        item = merged[key]
+        item['revenue'] = round(item['revenue'] or 0, 2)
+        report.append(item)
+    site = [{'period': key, 'new_users': value[0] or 0, 'article_views': value[1] or 0}
+            for key, value in sorted(site_rows.items())]
+    
+    if request.args.get('format') == 'csv':
+        output = io.StringIO()
+        fields = ['period'] + (['branch'] if by in ('doctor', 'service') else []) \
+            + ([f'{by}_id' if by != 'status' else 'status'] if by else []) + ['appointments', 'revenue']
+        writer = csv.DictWriter(output, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(report)
+        output.write('\n')
+        writer = csv.DictWriter(output, fieldnames=['period', 'new_users', 'article_views'])
+        writer.writeheader()
+        writer.writerows(site)
+        filename = f'report_{date_from}_{date_to}.csv'
+        return Response(output.getvalue(), mimetype='text/csv',
+                        headers={'Content-Disposition': f'attachment; filename={filename}'})
+    
+    return jsonify({
+        'from': date_from.isoformat(),
+        'to': date_to.isoformat(),
+        'period': period,
+        'by': by,
+        'appointments': report,
+        'site': site
+    })
+
+def finite_number(value):
+    """float из значения запроса или None, если это не конечное число (в том числе NaN, inf, True)"""
+    if isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+# Флаги из формы приходят строками; из JSON принимается только true/false
+FORM_BOOLEANS = {'1': True, 'true': True, 'on': True, 'yes': True,
+                 '0': False, 'false': False, 'off': False, 'no': False}
+
+@app.route('/admin/profiler', methods=['GET', 'POST'])
+@admin_required
+def admin_profiler():
+    """Состояние профилировщика; POST enabled, sample_rate (0..1), path, interval (сек)"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        from_form = data is None
+        if from_form:
+            data = request.form.to_dict()
+        elif not isinstance(data, dict):
+            return jsonify({'error': 'Ожидается JSON-объект'}), 400
+        
+        enabled = data.get('enabled')
+        if from_form and enabled not in (None, ''):
+            enabled = FORM_BOOLEANS.get(enabled.lower())
+            if enabled is None:
+                return jsonify({'error': 'enabled должен быть true или false'}), 400
+        elif from_form:
+            enabled = None
+        elif enabled is not None and not isinstance(enabled, bool):
+            return jsonify({'error': 'enabled должен быть true или false'}), 400
+        
+        sample_rate = data.get('sample_rate')
+        if sample_rate not in (None, ''):
+            sample_rate = finite_number(sample_rate)
+            if sample_rate is None or not 0 <= sample_rate <= 1:
+                return jsonify({'error': 'sample_rate должен быть числом от 0 до 1'}), 400
+        else:
+            sample_rate = None
+        
+        interval = data.get('interval')
+        if interval not in (None, ''):
+            interval = finite_number(interval)
+            if interval is None or interval <= 0:
+                return jsonify({'error': 'interval должен быть положительным числом секунд'}), 400
+        else:
+            interval = None
+        
+        path_prefix = data.get('path')
+        if path_prefix is not None and not isinstance(path_prefix, str):
+            return jsonify({'error': 'path должен быть строкой'}), 400
+        
+        profiler.configure(enabled=enabled, sample_rate=sample_rate, path_prefix=path_prefix, interval=interval)
+        if data.get('reset'):
+            profiler.reset()
+    return jsonify({
+        'enabled': profiler.enabled,
+        'sample_rate': profiler.sample_rate,
+        'path': profiler.path_prefix,
+        'interval': profiler.interval,
+        'requests': dict(profiler.requests),
+        'samples': {endpoint: sum(stacks.values()) for endpoint, stacks in profiler.stacks.items()}
+    })
+
+@app.route('/admin/profiler/collapsed')
+@admin_required
+def admin_profiler_collapsed():
+    """Свернутые стеки для flamegraph.pl / speedscope"""
+    endpoint = request.args.get('endpoint')
+    filename = f"profile-{endpoint or 'all'}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded"
+    return Response(profiler.collapsed(endpoint), mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@app.route('/admin/profiler/top')
+@admin_required
+def admin_profiler_top():
+    limit = min(request.args.get('limit', 20, type=int), 200)
+    return jsonify(profiler.top_functions(request.args.get('endpoint'), limit))
+
+@app.route('/admin/slow-queries', methods=['GET', 'POST'])
+@admin_required
+def admin_slow_queries():
+    """Журнал медленных запросов; POST threshold_ms, reset"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or request.form.to_dict()
+        if data.get('threshold_ms') not in (None, ''):
+            try:
+                threshold_ms = float(data['threshold_ms'])
+            except (TypeError, ValueError):
+                threshold_ms = None
+            if threshold_ms is None or not math.isfinite(threshold_ms) or threshold_ms < 0:
+                return jsonify({'error': 'threshold_ms должен быть неотрицательным числом'}), 400
+            slow_query_log.threshold_ms = threshold_ms
+        if data.get('reset'):
+            slow_query_log.reset()
+    return jsonify({
+        'threshold_ms': slow_query_log.threshold_ms,
+        'queries': slow_query_log.snapshot(request.args.get('order', 'total_ms'))
+    })
+
+def ensure_shared_models(*models):
+    """Команда, которая работает только с основной базой, не должна трогать данные филиалов"""
+    scoped = [model.__name__ for model in models if model.__table__ in scoped_tables()]
+    if scoped:
+        raise click.ClickException(f"Данные {', '.join(scoped)} лежат в базах филиалов - "
+                                   f"команду нужно выполнять для каждого филиала")
+
+@app.cli.command('rebuild-reports')
+def rebuild_reports():
+    """Полный пересчет агрегатов отчетов по существующим данным (во всех филиалах)"""
+    def rebuild_branch():
+        DailyAppointmentStat.query.delete()
+        deltas = {}
+        for model in (Appointment, ArchivedAppointment):
+            rows = db.session.query(model.doctor_id, model.service_id,
+                                    model.date_time, model.status).yield_per(5000)
+            for row in rows:
+                key = _rollup_key(*row)
+                deltas[key] = deltas.get(key, 0) + 1
+        apply_appointment_deltas(db.session.connection(bind_arguments={'mapper': Appointment}), deltas)
+        db.session.commit()
+        return len(deltas)
+    
+    for branch in branch_router.all():
+        print(f"{branch.name}: пересчитано строк отчетов: {branch_router.run(branch, rebuild_branch)}")
+    
+    DailySiteStat.query.delete()
+    site_deltas = {}
+    for (created_at,) in db.session.query(User.created_at).filter(User.created_at.isnot(None)).yield_per(5000):
+        key = (created_at.date(), 'new_users')
+        site_deltas[key] = site_deltas.get(key, 0) + 1
+    apply_site_deltas(db.session.connection(), site_deltas)
+    db.session.commit()
+
+@app.cli.command('migrate-appointment-version')
+def migrate_appointment_version():
+    """Добавляет столбец version (оптимистичная блокировка записей) в таблицу записей старых баз всех филиалов"""
+    def migrate_branch():
+        engine = db.session.get_bind(mapper=Appointment)
+        columns = [c['name'] for c in inspect(engine).get_columns('appointment')]
+        if 'version' in columns:
+            return False
+        with engine.begin() as conn:
+            conn.execute(db.text('ALTER TABLE appointment ADD COLUMN version INTEGER NOT NULL DEFAULT 1'))
+        return True
+    
+    # Таблица филиалов нужна, чтобы их перечислить; существующие таблицы create_all не трогает
+    db.create_all()
+    for branch in branch_router.databases():
+        branch_router.create_tables(branch)
+        if branch_router.run(branch, migrate_branch):
+            print(f"{branch.name}: добавлен столбец appointment.version")
+        else:
+            print(f"{branch.name}: столбец version уже есть")
+
+@app.cli.command('migrate-pets')
+@click.option('--batch-size', default=1000, help='Сколько записей обрабатывать за одну транзакцию')
+def migrate_pets(batch_size):
+    """Однократный перенос питомцев из полей записей в таблицу Pet (можно прерывать и перезапускать).
+
+    Записи лежат в базах филиалов, питомцы - в основной базе: филиалы
+    обходятся по очереди, каждый в своем контексте.
+    """
+    def migrate_branch():
+        engine = db.session.get_bind(mapper=Appointment)
+        columns = [c['name'] for c in inspect(engine).get_columns('appointment')]
+        if 'pet_id' not in columns:
+            with engine.begin() as conn:
+                conn.execute(db.text('ALTER TABLE appointment ADD COLUMN pet_id INTEGER REFERENCES pet(id)'))
+                conn.execute(db.text('CREATE INDEX IF NOT EXISTS ix_appointment_pet_date_time '
+                                     'ON appointment (pet_id, date_time)'))
+        
+        table = Appointment.__table__
+        pets = {}
+        last_id = 0
+        migrated = 0
+        while True:
+            # Keyset-проход по записям без питомца, новые записи сверху не нужны - идем по id
+            rows = db.session.execute(
+                db.select(table.c.id, table.c.client_id, table.c.pet_name, table.c.pet_species,
+                          table.c.pet_age, table.c.date_time)
+                .where(table.c.id > last_id, table.c.pet_id.is_(None), table.c.client_id.isnot(None))
+                .order_by(table.c.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            
+            updates = []
+            for row in rows:
+                key = (row.client_id, normalize_pet_name(row.pet_name), (row.pet_species or '').strip().lower() or None)
+                if key not in pets:
+                    pet = Pet.query.filter_by(owner_id=key[0], name=key[1], species=key[2]).first()
+                    if pet is None:
+                        pet = Pet(owner_id=key[0], name=key[1] or 'Без имени', species=key[2])
+                        db.session.add(pet)
+                        db.session.flush()
+                    pets[key] = pet
+                pet = pets[key]
+                if row.pet_age is not None and row.date_time:
+                    pet.birth_year = row.date_time.year - row.pet_age
+                updates.append({'b_id': row.id, 'b_pet_id': pet.id})
+            
+            # Питомцы (основная база) фиксируются раньше записей филиала: базы разные,
+            # и при обрыве между коммитами перезапуск просто найдет уже созданных питомцев
+            db.session.commit()
+            db.session.execute(
+                table.update().where(table.c.id == db.bindparam('b_id')).values(pet_id=db.bindparam('b_pet_id')),
+                updates
+            )
+            db.session.commit()
+            last_id = rows[-1].id
+            migrated += len(rows)
+            print(f"  Обработано записей: {migrated}")
+        return migrated
+    
+    db.create_all()
+    migrated = 0
+    for branch in branch_router.databases():
+        branch_router.create_tables(branch)
+        count = branch_router.run(branch, migrate_branch)
+        print(f"{branch.name}: перенесено записей: {count}")
+        migrated += count
+    
+    print(f"Готово. Питомцев: {Pet.query.count()}, перенесено записей: {migrated}")
+
+@app.cli.command('migrate-excerpts')
+@click.option('--batch-size', default=500, help='Сколько строк обрабатывать за одну транзакцию')
+def migrate_excerpts(batch_size):
+    """Добавляет столбцы анонса/времени чтения и заполняет их для старых статей и новостей.
+
+    Статьи и новости общие для всех филиалов и лежат только в основной базе.
+    """
+    ensure_shared_models(Article, News)
+    for model in (Article, News):
+        table = model.__table__
+        columns = [c['name'] for c in inspect(db.engine).get_columns(table.name)]
+        with db.engine.begin() as conn:
+            if 'excerpt' not in columns:
+                conn.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN excerpt VARCHAR(300)'))
+            if 'reading_time' not in columns:
+                conn.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN reading_time INTEGER'))
+        
+        last_id = 0
+        filled = 0
+        while True:
+            rows = db.session.execute(
+                db.select(table.c.id, table.c.content)
+                .where(table.c.id > last_id, table.c.excerpt.is_(None))
+                .order_by(table.c.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            db.session.execute(
+                table.update().where(table.c.id == db.bindparam('b_id'))
+                .values(excerpt=db.bindparam('b_excerpt'), reading_time=db.bindparam('b_reading_time')),
+                [{'b_id': row.id, 'b_excerpt': make_excerpt(rich_text.plain_text(row.content)),
+                  'b_reading_time': reading_minutes(rich_text.plain_text(row.content))} for row in rows]
+            )
+            db.session.commit()
+            last_id = rows[-1].id
+            filled += len(rows)
+        print(f"{table.name}: заполнено {filled}")
+
+@app.cli.command('render-content')
+@click.option('--batch-size', default=200, help='Сколько строк обрабатывать за одну транзакцию')
+def render_all_content(batch_size):
+    """Рендер Markdown в HTML для статей и новостей (после обновления или смены версии рендера).
+
+    Статьи и новости общие для всех филиалов и лежат только в основной базе.
+    """
+    ensure_shared_models(Article, News)
+    for model in (Article, News):
+        table = model.__table__
+        columns = [c['name'] for c in inspect(db.engine).get_columns(table.name)]
+        with db.engine.begin() as conn:
+            if 'content_html' not in columns:
+                conn.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN content_html TEXT'))
+            if 'content_hash' not in columns:
+                conn.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN content_hash VARCHAR(64)'))
+        
+        last_id = 0
+        rendered = 0
+        while True:
+            items = model.query.filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+            if not items:
+                break
+            rendered += sum(1 for item in items if render_content(item))
+            db.session.commit()
+            last_id = items[-1].id
+        print(f"{table.name}: перерендерено {rendered}")
+
+@app.cli.command('rebuild-similar')
+def rebuild_similar():
+    """Полный пересчет похожих статей"""
+    model = load_tfidf_model()
+    ArticleSimilarity.query.delete()
+    connection = db.session.connection()
+    for batch in model.all_neighbours(SIMILAR_ARTICLES_COUNT):
+        store_similar_articles(connection, dict(batch))
+    db.session.commit()
+    print(f"Посчитаны похожие статьи для {len(model.vectors)} статей")
+
+@app.cli.command('rebuild-agenda')
+def rebuild_agenda():
+    """Полный пересчет сводок расписания во всех филиалах (после импорта данных в обход ORM)"""
+    def rebuild_branch():
+        keys = set()
+        for model in (Appointment, ArchivedAppointment):
+            rows = db.session.query(model.doctor_id, model.date_time).filter(
+                model.doctor_id.isnot(None)).yield_per(1000)
+            for doctor_id, date_time in rows:
+                keys.add((doctor_id, date_time.date()))
+        DoctorDaySummary.query.delete()
+        refresh_day_summaries(db.session.connection(bind_arguments={'mapper': Appointment}), keys,
+                              archive_connection=db.session.connection(bind_arguments={'mapper': ArchivedAppointment}))
+        db.session.commit()
+        return len(keys)
+    
+    for branch in branch_router.all():
+        print(f"{branch.name}: пересчитано сводок: {branch_router.run(branch, rebuild_branch)}")
+
+def archive_appointments_batch(horizon, batch_size):
+    """Переносит одну пачку старых записей в архив; возвращает число перенесенных.
+
+    Сначала вставка в архив (повторная вставка того же id игнорируется), потом
+    удаление из рабочей таблицы - обрыв между шагами безопасен, следующий запуск
+    просто продолжит. Каждая пачка - две короткие транзакции, чтобы не держать
+    блокировку записи рабочей базы. Работает с базами текущего филиала.
+    """
+    table = Appointment.__table__
+    archive = ArchivedAppointment.__table__
+    columns = [c.name for c in table.columns]
+    engine = db.session.get_bind(mapper=Appointment)
+    with engine.connect() as conn:
+        rows = conn.execute(
+            db.select(table).where(table.c.date_time < horizon, table.c.status.in_(ARCHIVABLE_STATUSES))
+            .order_by(table.c.date_time, table.c.id).limit(batch_size)
+        ).mappings().all()
+    if not rows:
+        return 0
+    archived_at = datetime.utcnow()
+    with db.session.get_bind(mapper=ArchivedAppointment).begin() as conn:
+        conn.execute(sqlite_insert(archive).on_conflict_do_nothing(index_elements=['id']),
+                     [dict({name: row[name] for name in columns}, archived_at=archived_at) for row in rows])
+    ids = [row['id'] for row in rows]
+    with engine.begin() as conn:
+        # Удаляем только то, что все еще подлежит архивации (статус могли поменять)
+        conn.execute(table.delete().where(table.c.id.in_(ids), table.c.date_time < horizon,
+                                          table.c.status.in_(ARCHIVABLE_STATUSES)))
+    return len(ids)
+
+@app.cli.command('archive-appointments')
+@click.option('--days', default=None, type=int, help='Горизонт в днях (по умолчанию ARCHIVE_AFTER_DAYS)')
+@click.option('--batch-size', default=500, help='Сколько записей переносить за одну пачку')
+@click.option('--pause', default=0.05, help='Пауза между пачками в секундах, чтобы пропускать запись с сайта')
+def archive_appointments(days, batch_size, pause):
+    """Перенос завершенных/отмененных записей старше горизонта в архивную базу"""
+    db.create_all()
+    horizon = datetime.now() - timedelta(days=days if days is not None else app.config['ARCHIVE_AFTER_DAYS'])
+    
+    def archive_branch(branch):
+        moved = 0
+        while True:
+            count = archive_appointments_batch(horizon, batch_size)
+            if not count:
+                break
+            moved += count
+            print(f"  {branch.name}: перенесено в архив: {moved}")
+            time.sleep(pause)
+        return moved, ArchivedAppointment.query.count()
+    
+    for branch in branch_router.all():
+        branch_router.create_tables(branch)
+        moved, total = branch_router.run(branch, archive_branch, branch)
+        print(f"{branch.name}: перенесено записей: {moved}, в архиве всего: {total}")
+
+@app.cli.command('branch-add')
+@click.argument('slug')
+@click.argument('name')
+@click.option('--address', default=None, help='Адрес филиала')
+@click.option('--phone', default=None, help='Телефон филиала')
+@click.option('--database', default=None,
+              help='Адрес базы филиала (по умолчанию sqlite:///vetclinic_<slug>.db); main - основная база')
+def branch_add(slug, name, address, phone, database):
+    """Новый филиал и таблицы в его базе. Первый филиал по умолчанию хранится в основной базе"""
+    db.create_all()
+    if Branch.query.filter_by(slug=slug).first():
+        raise click.ClickException(f'Филиал {slug} уже существует')
+    if database is None:
+        database = 'main' if Branch.query.count() == 0 else f'sqlite:///vetclinic_{slug}.db'
+    branch = Branch(slug=slug, name=name, address=address, phone=phone,
+                    database=None if database == 'main' else database)
+    db.session.add(branch)
+    db.session.commit()
+    info = BranchInfo(branch.id, branch.slug, branch.name, branch.address, branch.phone, branch.database)
+    branch_router.create_tables(info)
+    print(f"Создан филиал {slug}: {branch.database or 'основная база'}")
+
+@app.cli.command('branch-list')
+def branch_list():
+    """Филиалы и число записей в каждом (запросы к базам филиалов - параллельно)"""
+    for branch, count in branch_router.fan_out(lambda branch: Appointment.query.count()):
+        print(f"{branch.slug:<15} {branch.name:<30} {branch.database or 'основная база':<40} записей: {count}")
+
+@app.cli.command('backup')
+def backup_database():
+    """Резервная копия всех баз (основная, архив, филиалы) без остановки сайта и чистка старых копий"""
+    manifest = backup_manager.create()
+    print(f"Создана копия {manifest['name']}: {manifest['pages']} страниц, "
+          f"{manifest['compressed_size'] // 1024} КБ сжато, {manifest['seconds']} с")
+    for label, entry in manifest['databases'].items():
+        print(f"  {label}: {entry['pages']} страниц, sha256 {entry['sha256'][:12]}")
+    for name in backup_manager.prune():
+        print(f"  Удалена старая копия {name}")
+
+@app.cli.command('backup-list')
+def backup_list():
+    """Список резервных копий"""
+    for manifest in backup_manager.list():
+        print(f"{manifest['name']}  {manifest['created_at']}  {manifest['compressed_size'] // 1024} КБ  "
+              f"базы: {', '.join(manifest['databases'])}")
+
+@app.cli.command('backup-verify')
+@click.argument('name')
+def backup_verify(name):
+    """Проверка контрольной суммы и целостности копии"""
+    try:
+        backup_manager.verify(name)
+    except (OSError, ValueError) as e:
+        raise click.ClickException(str(e))
+    print(f"Копия {name} в порядке")
+
+@app.cli.command('backup-restore')
+@click.argument('name')
+@click.option('--target', default=None, help='Каталог, куда восстановить базы (по умолчанию - в рабочие базы)')
+@click.option('--database', 'only', multiple=True, help='Восстановить только эту базу (main, archive, branch-<slug>)')
+@click.confirmation_option(prompt='Данные баз будут заменены копией. Продолжить?')
+def backup_restore(name, target, only):
+    """Восстановление баз из резервной копии"""
+    try:
+        manifest = backup_manager.restore(name, target, only)
+    except (OSError, ValueError) as e:
+        raise click.ClickException(str(e))
+    print(f"Восстановлена копия от {manifest['created_at']}")
+
+@app.cli.command('worker')
+def run_worker():
+    """Запуск обработчика фоновых задач отдельным процессом"""
+    job_queue.start(app.config['JOB_WORKERS'])
+    start_backup_schedule()
+    print(f"Обработчик задач запущен ({app.config['JOB_WORKERS']} потоков). Ctrl+C для остановки")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        job_queue.stop()
+
 @app.errorhandler(404)
 def page_not_found(e):
     return render_template('404.html'), 404
 
 # API для получения данных (для AJAX)
+def select_fields(available, wanted):
+    """Поля ответа API: все доступные или только запрошенные (fields=id,name).
+    available - имена или пары (ключ, функция) для rows_to_json."""
+    if not wanted:
+        return available
+    if isinstance(wanted, str):
+        wanted = [name.strip() for name in wanted.split(',') if name.strip()]
+    by_key = {field[0] if isinstance(field, tuple) else field: field for field in available}
+    unknown = [name for name in wanted if name not in by_key]
+    if unknown:
+        raise ValueError(f'Неизвестные поля: {", ".join(unknown)}')
+    return [by_key[name] for name in wanted]
+
+def parse_api_date(value):
+    try:
+        return datetime.strptime(value or '', '%Y-%m-%d').date()
+    except ValueError:
+        return datetime.today().date()
+
+def doctors_json(args):
+    """Врачи с фильтрами specialization, min_experience, day (пн..вс или 0-6).
+    sort=next_slot ранжирует по ближайшему свободному окну на date (по умолчанию -
+    ближайший день недели day, начиная с сегодня, а без day - сегодня)."""
+    directory = get_doctor_directory()
+    weekday = args.get('day')
+    if weekday is not None:
+        weekday = weekday.strip().lower()[:2]
+        weekday = WEEKDAYS.index(weekday) if weekday in WEEKDAYS else \
+            (int(weekday) if weekday.isdigit() and int(weekday) < 7 else None)
+    positions = directory.query(
+        specialization=args.get('specialization'),
+        min_experience=args.get('min_experience', type=int),
+        weekday=weekday
+    )
+    
+    slots = {}
+    if args.get('sort') == 'next_slot':
+        if args.get('date') or weekday is None:
+            day = parse_api_date(args.get('date'))
+        else:
+            # ?day=сб без даты - окна ближайшей субботы, а не сегодняшнего дня
+            today = datetime.today().date()
+            day = today + timedelta(days=(weekday - today.weekday()) % 7)
+        busy = busy_minutes_by_doctor(day)
+        now = datetime.now()
+        for position in positions:
+            row = directory.rows[position]
+            slots[position] = directory.next_free_slot(position, day, busy.get(row.id, set()), now)
+        # Врачи без свободных окон - в конце списка
+        positions.sort(key=lambda p: (slots[p] is None, slots[p] or datetime.max))
+    
+    fields = ['id', 'name', 'specialization', 'experience', 'photo_url']
+    if slots:
+        free_slots = {directory.rows[p].id: slot for p, slot in slots.items()}
+        fields.append(('next_free_slot', lambda row: free_slots[row.id]))
+    fields = select_fields(fields, args.get('fields'))
+    return rows_to_json((directory.rows[p] for p in positions), fields)
+
+def services_json(args):
+    """Каталог услуг из памяти: фильтры category, min_price, max_price, max_duration (мин), q,
+    сортировка sort=price|-price|duration|name, постранично limit/offset.
+    С facets=1 возвращает объект со счетчиками фасетов вместо списка."""
+    price_range = dict((label, (low, high)) for label, low, high in PRICE_RANGES).get(args.get('price_range'))
+    price_min = args.get('min_price', type=float)
+    price_max = args.get('max_price', type=float)
+    if price_range:
+        price_min, price_max = price_range[0], (price_range[1] - 0.01 if price_range[1] else None)
+    duration_max = args.get('max_duration', type=int)
+    duration_range = dict((label, high) for label, low, high in DURATION_RANGES).get(args.get('duration_range'))
+    if duration_range:
+        duration_max = duration_range
+    
+    rows, total, facets = get_service_catalog().query(
+        category=args.get('category') or None,
+        price_min=price_min,
+        price_max=price_max,
+        duration_max=duration_max,
+        text=args.get('q'),
+        sort=args.get('sort'),
+        limit=args.get('limit', type=int),
+        offset=args.get('offset', 0, type=int)
+    )
+    fields = select_fields(['id', 'name', 'category', 'price', 'duration', 'duration_minutes'], args.get('fields'))
+    items = rows_to_json(rows, fields)
+    if args.get('facets') == '1':
+        return f'{{"items":{items},"total":{total},"facets":{to_json(facets)}}}'
+    return items
+
+def slots_json(args):
+    """Свободные окна врачей на date (по умолчанию сегодня); фильтры doctor_id, specialization"""
+    directory = get_doctor_directory()
+    day = parse_api_date(args.get('date'))
+    doctor_id = args.get('doctor_id', type=int)
+    positions = directory.query(specialization=args.get('specialization'), weekday=day.weekday())
+    busy = busy_minutes_by_doctor(day)
+    now = datetime.now()
+    free = {}
+    for position in positions:
+        row = directory.rows[position]
+        if doctor_id is None or row.id == doctor_id:
+            free[row.id] = list(directory.free_slots(position, day, busy.get(row.id, set()), now))
+    fields = select_fields(['id', 'name', 'specialization', ('slots', lambda row: free[row.id])], args.get('fields'))
+    return rows_to_json((directory.rows[p] for p in positions if directory.rows[p].id in free), fields)
+
+# Ресурсы, доступные через /api/batch: имя -> функция(args) -> текст JSON
+API_RESOURCES = {
+    'doctors': doctors_json,
+    'services': services_json,
+    'slots': slots_json,
+}
+API_BATCH_MAX_PARTS = 10
+
+def api_resource_response(name):
+    try:
+        return json_response(API_RESOURCES[name](request.args))
+    except ValueError as e:
+        return json_response(to_json({'error': str(e)}), 400)
+
 @app.route('/api/doctors')
 def api_doctors():
-    doctors = Doctor.query.all()
-    result = []
-    for doctor in doctors:
-        result.append({
-            'id': doctor.id,
-            'name': doctor.name,
-            'specialization': doctor.specialization,
-            'photo_url': doctor.photo_url
-        })
-    return jsonify(result)
+    return api_resource_response('doctors')
 
 @app.route('/api/services')
 def api_services():
-    services = Service.query.all()
-    result = []
-    for service in services:
-        result.append({
-            'id': service.id,
-            'name': service.name,
-            'category': service.category,
-            'price': service.price
-        })
-    return jsonify(result)
+    return api_resource_response('services')
+
+@app.route('/api/slots')
+def api_slots():
+    return api_resource_response('slots')
+
+def json_etag(text):
+    return '"' + hashlib.sha1(text.encode('utf-8')).hexdigest()[:16] + '"'
+
+@app.route('/api/batch', methods=['GET', 'POST'])
+def api_batch():
+    """Несколько ресурсов API за один запрос - в одном контексте приложения и одной сессии БД.
+
+    Тело (POST) или параметр requests (GET) - список частей:
+    [{"id": "doctors", "resource": "doctors", "params": {...}, "fields": [...], "if_none_match": "..."}].
+    Ответ - {"responses": [{"id", "status", "etag", "body"}]} в том же порядке.
+    У каждой части свой ETag; если он совпал с if_none_match, части отдается 304 без body.
+    """
+    if request.method == 'POST':
+        parts = request.get_json(silent=True)
+    else:
+        try:
+            parts = json.loads(request.args.get('requests', ''))
+        except ValueError:
+            parts = None
+    if isinstance(parts, dict):
+        parts = parts.get('requests')
+    if not isinstance(parts, list) or not parts:
+        return json_response(to_json({'error': 'Ожидается непустой список запросов'}), 400)
+    if len(parts) > API_BATCH_MAX_PARTS:
+        return json_response(to_json({'error': f'Не больше {API_BATCH_MAX_PARTS} запросов за раз'}), 400)
+    
+    responses = []
+    for index, part in enumerate(parts):
+        if not isinstance(part, dict):
+            part = {}
+        part_id = to_json(str(part.get('id', index)))
+        resource = API_RESOURCES.get(part.get('resource'))
+        if resource is None:
+            error = to_json({'error': f'Неизвестный ресурс: {part.get("resource")}'})
+            responses.append(f'{{"id":{part_id},"status":404,"body":{error}}}')
+            continue
+        params = part.get('params') if isinstance(part.get('params'), dict) else {}
+        args = MultiDict((key, str(value)) for key, value in params.items() if value is not None)
+        if part.get('fields'):
+            args['fields'] = ','.join(part['fields']) if isinstance(part['fields'], list) else str(part['fields'])
+        try:
+            body = resource(args)
+        except ValueError as e:
+            responses.append(f'{{"id":{part_id},"status":400,"body":{to_json({"error": str(e)})}}}')
+            continue
+        etag = json_etag(body)
+        if part.get('if_none_match') == etag:
+            responses.append(f'{{"id":{part_id},"status":304,"etag":{to_json(etag)}}}')
+        else:
+            responses.append(f'{{"id":{part_id},"status":200,"etag":{to_json(etag)},"body":{body}}}')
+    response = json_response('{"responses":[' + ','.join(responses) + ']}')
+    # Ответ зависит от содержимого частей, а не только от адреса
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        for branch in branch_router.all():
+            branch_router.create_tables(branch)
         
         # Создаем администратора по умолчанию, если его нет
         if not User.query.filter_by(role='admin').first():
@@ -625,6 +2757,10 @@ if __name__ == '__main__':
                 db.session.commit()
                 print("Созданы тестовые новости")
     
+    # При debug=True код запускается дважды (reloader) - стартуем воркеры только в дочернем процессе
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        job_queue.start(app.config['JOB_WORKERS'])
+        start_backup_schedule()
     app.run(debug=True)
     
     
\ No newline at end of file
@@ -0,0 +1,289 @@
+"""
+Резервные копии баз SQLite без остановки сайта
+
+Копия снимается штатным online backup API SQLite маленькими порциями
+страниц с паузами между ними, поэтому запись с сайта не ждет окончания
+копирования. Одна копия - это набор файлов, по файлу на каждую базу
+(основная, архив, базы филиалов), и общий манифест: для каждой базы
+размер, число страниц, SHA-256 сжатого файла. Каждый файл проверяется
+(PRAGMA quick_check) и сжимается gzip. Восстановление сверяет контрольные
+суммы и проверяет все базы набора до того, как заменить рабочие.
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _quick_check(path):
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute('PRAGMA quick_check').fetchone()[0]
+    finally:
+        conn.close()
+    if result != 'ok':
+        raise ValueError(f'Копия базы повреждена: {result}')
+
+
+class BackupManager:
+    """databases - словарь {метка: путь к файлу базы} или функция, которая его
+    возвращает (список баз филиалов меняется, поэтому он читается при каждой копии)
+    """
+
+    def __init__(self, databases, backup_dir, pages=256, step_sleep=0.01,
+                 keep_last=3, keep_daily=7, keep_weekly=4):
+        self.databases = databases
+        self.backup_dir = backup_dir
+        # pages страниц за шаг и пауза step_sleep между шагами - сайт успевает писать
+        self.pages = pages
+        self.step_sleep = step_sleep
+        self.keep_last = keep_last
+        self.keep_daily = keep_daily
+        self.keep_weekly = keep_weekly
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _copy(self, source_path, target_path):
+        source = sqlite3.connect(source_path)
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target, pages=self.pages, sleep=self.step_sleep)
+            return target.execute('PRAGMA page_count').fetchone()[0]
+        finally:
+            target.close()
+            source.close()
+
+    def _databases(self):
+        return dict(self.databases() if callable(self.databases) else self.databases)
+
+    def _reserve_name(self, created_at):
+        """Уникальное имя копии: при совпадении секунды добавляется счетчик.
+
+        Имя занимается созданием временного манифеста с O_EXCL - так две копии,
+        снятые одновременно (команда backup и планировщик), не затрут друг друга.
+        """
+        base = 'vetclinic-' + created_at.strftime('%Y%m%d-%H%M%S')
+        counter = 0
+        while True:
+            name = base if counter == 0 else f'{base}-{counter}'
+            if not os.path.exists(self._path(name + '.json')):
+                try:
+                    os.close(os.open(self._path(name + '.json.tmp'), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                    return name
+                except FileExistsError:
+                    pass
+            counter += 1
+
+    def _snapshot(self, db_path, filename):
+        fd, raw_path = tempfile.mkstemp(suffix='.db', dir=self.backup_dir)
+        os.close(fd)
+        try:
+            page_count = self._copy(db_path, raw_path)
+            _quick_check(raw_path)
+            raw_size = os.path.getsize(raw_path)
+            with open(raw_path, 'rb') as src, gzip.open(self._path(filename) + '.tmp', 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            os.replace(self._path(filename) + '.tmp', self._path(filename))
+        finally:
+            os.remove(raw_path)
+        return {
+            'file': filename,
+            'pages': page_count,
+            'size': raw_size,
+            'compressed_size': os.path.getsize(self._path(filename)),
+            'sha256': _sha256(self._path(filename)),
+        }
+
+    def create(self):
+        """Снимает копию всех баз, возвращает ее манифест"""
+        os.makedirs(self.backup_dir, exist_ok=True)
+        with self._lock:
+            created_at = datetime.now()
+            name = self._reserve_name(created_at)
+            started = time.time()
+            databases = {}
+            try:
+                for label, db_path in self._databases().items():
+                    # База филиала, в который еще ничего не писали, может быть не создана
+                    if os.path.exists(db_path):
+                        databases[label] = self._snapshot(db_path, f'{name}.{label}.db.gz')
+            except Exception:
+                for entry in databases.values():
+                    os.remove(self._path(entry['file']))
+                os.remove(self._path(name + '.json.tmp'))
+                raise
+
+            manifest = {
+                'name': name,
+                'created_at': created_at.isoformat(timespec='seconds'),
+                'databases': databases,
+                'pages': sum(entry['pages'] for entry in databases.values()),
+                'size': sum(entry['size'] for entry in databases.values()),
+                'compressed_size': sum(entry['compressed_size'] for entry in databases.values()),
+                'seconds': round(time.time() - started, 3),
+            }
+            # Манифест пишется последним: копия без манифеста считается незавершенной
+            with open(self._path(name + '.json.tmp'), 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            os.replace(self._path(name + '.json.tmp'), self._path(name + '.json'))
+            return manifest
+
+    def _path(self, name):
+        # Имя приходит в том числе из командной строки - не даем выйти из каталога
+        return os.path.join(self.backup_dir, os.path.basename(name))
+
+    @staticmethod
+    def _normalize(manifest):
+        # Копии до появления наборов: один файл основной базы, манифест без 'databases'
+        if 'databases' not in manifest:
+            manifest['databases'] = {'main': {key: manifest[key] for key in ('pages', 'size', 'compressed_size', 'sha256')}}
+            manifest['databases']['main']['file'] = manifest['name']
+        return manifest
+
+    def list(self):
+        """Манифесты копий, новые сверху"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        manifests = []
+        for filename in os.listdir(self.backup_dir):
+            if filename.endswith('.json'):
+                with open(self._path(filename), encoding='utf-8') as f:
+                    manifests.append(self._normalize(json.load(f)))
+        return sorted(manifests, key=lambda m: (m['created_at'], m['name']), reverse=True)
+
+    def manifest(self, name):
+        with open(self._path(name + '.json'), encoding='utf-8') as f:
+            return self._normalize(json.load(f))
+
+    def _unpack(self, name, label):
+        """Проверяет сумму и распаковывает базу label из копии во временный файл"""
+        entry = self.manifest(name)['databases'][label]
+        if _sha256(self._path(entry['file'])) != entry['sha256']:
+            raise ValueError(f'Контрольная сумма копии {name} ({label}) не совпадает')
+        fd, raw_path = tempfile.mkstemp(suffix='.db', dir=self.backup_dir)
+        os.close(fd)
+        try:
+            with gzip.open(self._path(entry['file']), 'rb') as src, open(raw_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            _quick_check(raw_path)
+        except Exception:
+            os.remove(raw_path)
+            raise
+        return raw_path
+
+    def verify(self, name):
+        for label in self.manifest(name)['databases']:
+            os.remove(self._unpack(name, label))
+        return True
+
+    def restore(self, name, target_dir=None, only=None):
+        """Восстанавливает базы из копии: в рабочие базы или, если задан
+        target_dir, в файлы <метка>.db в этом каталоге. only - метки баз,
+        которые нужно восстановить (по умолчанию - все из копии).
+
+        Сначала проверяются и распаковываются все базы набора, потом они
+        записываются через тот же backup API, поэтому открытые соединения
+        приложения не ломаются, а сразу видят восстановленные данные.
+        """
+        manifest = self.manifest(name)
+        labels = list(only or manifest['databases'])
+        missing = [label for label in labels if label not in manifest['databases']]
+        if missing:
+            raise ValueError(f'В копии {name} нет баз: {", ".join(missing)}')
+        if target_dir:
+            os.makedirs(target_dir, exist_ok=True)
+            targets = {label: os.path.join(target_dir, label + '.db') for label in labels}
+        else:
+            current = self._databases()
+            unknown = [label for label in labels if label not in current]
+            if unknown:
+                raise ValueError(f'Базы {", ".join(unknown)} больше не подключены - укажите --target')
+            targets = {label: current[label] for label in labels}
+
+        unpacked = {}
+        try:
+            for label in labels:
+                unpacked[label] = self._unpack(name, label)
+            for label, raw_path in unpacked.items():
+                self._copy(raw_path, targets[label])
+        finally:
+            for raw_path in unpacked.values():
+                os.remove(raw_path)
+        return manifest
+
+    def prune(self, now=None):
+        """Удаляет копии вне политики хранения; возвращает имена удаленных.
+
+        Остаются keep_last последних, по одной (самой свежей) за каждый из
+        keep_daily последних дней и за каждую из keep_weekly последних недель.
+        """
+        now = now or datetime.now()
+        manifests = self.list()
+        keep = {m['name'] for m in manifests[:self.keep_last]}
+        days, weeks = set(), set()
+        for m in manifests:
+            created = datetime.fromisoformat(m['created_at'])
+            age = (now.date() - created.date()).days
+            day = created.date()
+            week = created.isocalendar()[:2]
+            if age < self.keep_daily and day not in days:
+                days.add(day)
+                keep.add(m['name'])
+            if age < self.keep_weekly * 7 and week not in weeks:
+                weeks.add(week)
+                keep.add(m['name'])
+        removed = []
+        for m in manifests:
+            if m['name'] not in keep:
+                for entry in m['databases'].values():
+                    os.remove(self._path(entry['file']))
+                os.remove(self._path(m['name'] + '.json'))
+                removed.append(m['name'])
+        return removed
+
+    def is_due(self, interval):
+        manifests = self.list()
+        if not manifests:
+            return True
+        last = datetime.fromisoformat(manifests[0]['created_at'])
+        return (datetime.now() - last).total_seconds() >= interval
+
+    def _schedule_loop(self, interval, on_error):
+        while not self._stop.is_set():
+            try:
+                # Время последней копии берем с диска - после перезапуска не копируем заново
+                if self.is_due(interval):
+                    self.create()
+                    self.prune()
+            except Exception as e:
+                on_error(e)
+            self._stop.wait(min(interval, 60))
+
+    def start(self, interval, on_error=print):
+        """Фоновый поток: копия каждые interval секунд и чистка старых"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._schedule_loop, args=(interval, on_error),
+                                        name='backup-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,62 @@
+"""
+Групповая запись в БД (group commit)
+
+Одновременные запросы складывают строки в общий буфер. Первый из них
+становится "лидером": ждет немного, пока соберется пачка, записывает ее
+одним INSERT и одним коммитом и будит остальных. Каждый запрос получает
+ответ только после того, как его строка закоммичена, поэтому при всплеске
+нагрузки данные не теряются, а число коммитов в SQLite резко падает.
+"""
+import threading
+import time
+
+
+class _Batch:
+    def __init__(self):
+        self.rows = []
+        self.done = threading.Event()
+        self.error = None
+
+
+class GroupCommitter:
+    def __init__(self, write_batch, max_batch=200, max_wait=0.02):
+        # write_batch(rows) должна записать список словарей одной транзакцией
+        self.write_batch = write_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._full = threading.Condition(self._lock)
+        self._current = None
+
+    def add(self, row):
+        """Добавляет строку и блокируется до коммита ее пачки"""
+        with self._lock:
+            batch = self._current
+            leader = batch is None
+            if leader:
+                batch = self._current = _Batch()
+            batch.rows.append(row)
+            if len(batch.rows) >= self.max_batch:
+                self._full.notify()
+
+        if not leader:
+            batch.done.wait()
+        else:
+            with self._lock:
+                deadline = time.monotonic() + self.max_wait
+                while len(batch.rows) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._full.wait(remaining)
+                # Новые строки пойдут уже в следующую пачку
+                self._current = None
+            try:
+                self.write_batch(batch.rows)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+
+        if batch.error is not None:
+            raise batch.error
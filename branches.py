@@ -0,0 +1,162 @@
+"""
+Филиалы клиники: данные филиала - в своей базе
+
+Врачи, услуги, записи, их архив, сводки расписания и агрегаты отчетов
+(модели с декоратором branch_scoped) принадлежат филиалу. Основной филиал
+хранит их в основной базе, остальные - каждый в своем файле SQLite, так что
+запись в одном филиале не ждет блокировку базы другого. Пользователи,
+питомцы, статьи и новости общие и всегда лежат в основной базе.
+
+Филиал текущего запроса хранится в g, а BranchSession по модели выбирает
+движок: базу филиала или основную. Одна сессия работает только с одним
+филиалом - id в базах филиалов пересекаются, и объекты разных баз не должны
+встречаться в одной identity map. Поэтому работа с другим филиалом (run) и
+запросы по всем филиалам (fan_out) выполняются в отдельном контексте
+приложения со своей сессией; fan_out - параллельно, по потоку на филиал.
+"""
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy as sa
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+
+BranchInfo = namedtuple('BranchInfo', 'id slug name address phone database')
+
+# Пока филиалы не заведены, вся клиника - один основной филиал в основной базе
+DEFAULT_BRANCH = BranchInfo(None, 'main', 'Основной филиал', None, None, None)
+
+_scoped_tables = set()
+
+
+def branch_scoped(model):
+    """Декоратор модели: строки хранятся в базе филиала"""
+    _scoped_tables.add(model.__table__)
+    return model
+
+
+def scoped_tables():
+    return sorted(_scoped_tables, key=lambda table: table.name)
+
+
+def _touches_scoped(mapper, clause):
+    if mapper is not None:
+        return sa.inspect(mapper).local_table in _scoped_tables
+    # Core-запросы по таблице: INSERT/UPDATE/DELETE - table, SELECT - from
+    if getattr(clause, 'table', None) in _scoped_tables:
+        return True
+    froms = getattr(clause, 'get_final_froms', None)
+    return froms is not None and any(table in _scoped_tables for table in froms())
+
+
+class BranchSession(Session):
+    """Сессия, которая отправляет запросы к данным филиала в базу текущего филиала"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            engine = g.get('branch_engine')
+            if engine is not None and _touches_scoped(mapper, clause):
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class BranchRouter:
+    """Список филиалов, движки их баз и выполнение работы в контексте филиала.
+
+    load - функция без аргументов, возвращающая BranchInfo активных филиалов
+    (перечитывается раз в ttl секунд и после invalidate). on_engine вызывается
+    для каждого нового движка, например чтобы подключить журнал медленных запросов.
+    """
+
+    def __init__(self, app, load, ttl=60, on_engine=None, max_workers=8):
+        self.app = app
+        self._load = load
+        self.ttl = ttl
+        self.on_engine = on_engine
+        self.max_workers = max_workers
+        self._branches = None
+        self._loaded_at = 0
+        self._engines = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._loaded_at = 0
+
+    def all(self):
+        if self._branches is None or time.time() - self._loaded_at > self.ttl:
+            self._branches = list(self._load()) or [DEFAULT_BRANCH]
+            self._loaded_at = time.time()
+        return self._branches
+
+    def default(self):
+        """Филиал в основной базе (первый такой), иначе первый по списку"""
+        branches = self.all()
+        return next((branch for branch in branches if not branch.database), branches[0])
+
+    def databases(self):
+        """По филиалу на каждую базу. Основная база входит всегда, даже если
+        филиалы заведены и ни один из них не хранит данные в ней (для миграций)
+        """
+        branches = self.all()
+        if all(branch.database for branch in branches):
+            branches = [DEFAULT_BRANCH] + branches
+        return branches
+
+    def get(self, slug):
+        return next((branch for branch in self.all() if branch.slug == slug), None)
+
+    def current(self):
+        return g.get('branch') or self.default()
+
+    def is_default(self, branch=None):
+        return not (branch or self.current()).database
+
+    def engine(self, database):
+        """Движок базы филиала; относительный путь SQLite - от instance, как у основной базы"""
+        with self._lock:
+            engine = self._engines.get(database)
+            if engine is None:
+                url = sa.engine.make_url(database)
+                if url.drivername.startswith('sqlite') and url.database not in (None, '', ':memory:') \
+                        and not os.path.isabs(url.database):
+                    os.makedirs(self.app.instance_path, exist_ok=True)
+                    url = url.set(database=os.path.join(self.app.instance_path, url.database))
+                engine = sa.create_engine(url)
+                if self.on_engine is not None:
+                    self.on_engine(engine)
+                self._engines[database] = engine
+            return engine
+
+    def activate(self, branch):
+        """Делает филиал текущим для контекста приложения (до первого запроса к его данным)"""
+        g.branch = branch
+        g.branch_engine = self.engine(branch.database) if branch.database else None
+
+    def create_tables(self, branch):
+        """Таблицы данных филиала в его базе (для основного филиала их создает db.create_all)"""
+        if branch.database:
+            engine = self.engine(branch.database)
+            for table in scoped_tables():
+                table.create(engine, checkfirst=True)
+
+    def run(self, branch, func, *args):
+        """func(*args) в новом контексте приложения с этим филиалом и своей сессией"""
+        with self.app.app_context():
+            self.activate(branch)
+            return func(*args)
+
+    def fan_out(self, func, branches=None):
+        """[(филиал, func(филиал))] по всем (или указанным) филиалам, параллельно.
+
+        Объекты ORM из результата отсоединены от сессии: связи, которые нужны
+        после возврата, надо загрузить внутри func (selectinload).
+        """
+        branches = list(branches if branches is not None else self.all())
+        if len(branches) == 1:
+            return [(branches[0], self.run(branches[0], func, branches[0]))]
+        with ThreadPoolExecutor(max_workers=min(len(branches), self.max_workers)) as pool:
+            futures = [pool.submit(self.run, branch, func, branch) for branch in branches]
+            return [(branch, future.result()) for branch, future in zip(branches, futures)]
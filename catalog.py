@@ -0,0 +1,290 @@
+"""
+Каталоги услуг и врачей в памяти
+
+Услуги хранятся по столбцам (массивы цен, длительностей, номеров
+категорий), фасеты - заранее посчитанные списки позиций. Фильтрация,
+сортировка и подсчет фасетов идут без обращения к базе. Врачи
+индексируются по специализациям, опыту и рабочим дням из расписания.
+"""
+import re
+import threading
+import time
+from array import array
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+ServiceRow = namedtuple('ServiceRow', 'id name description price category duration duration_minutes')
+
+PRICE_RANGES = (
+    ('0-1000', 0, 1000),
+    ('1000-2000', 1000, 2000),
+    ('2000-5000', 2000, 5000),
+    ('5000+', 5000, None),
+)
+
+DURATION_RANGES = (
+    ('до 30 мин', 0, 30),
+    ('30-60 мин', 31, 60),
+    ('больше часа', 61, None),
+)
+
+_DURATION_TOKEN = re.compile(r'(\d+(?:[.,]\d+)?)|(час|мин)')
+
+
+def parse_duration(text):
+    """'40 мин' -> 40, '1 час 30 мин' -> 90, '1-2 часа' -> 120; None, если не распознать"""
+    total = 0
+    pending = []
+    for number, unit in _DURATION_TOKEN.findall((text or '').lower()):
+        if number:
+            pending.append(float(number.replace(',', '.')))
+        elif pending:
+            # Для диапазона "1-2 часа" берем верхнюю границу
+            total += max(pending) * (60 if unit == 'час' else 1)
+            pending = []
+    if pending:
+        total += max(pending)
+    return int(total) if total else None
+
+
+class ServiceCatalog:
+    def __init__(self, ttl=60):
+        # ttl - как часто перечитывать таблицу, чтобы увидеть правки из других процессов
+        self.ttl = ttl
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self.ids = array('i')
+        self.prices = array('d')
+        self.durations = array('i')
+        self.category_codes = array('i')
+        self.categories = []
+        self.names = []
+        self.descriptions = []
+        self.duration_texts = []
+        self.by_category = {}
+        self.by_price = {}
+        self.by_duration = {}
+
+    def is_stale(self):
+        return self.loaded_at is None or time.time() - self.loaded_at > self.ttl
+
+    def invalidate(self):
+        self.loaded_at = None
+
+    def load(self, rows):
+        """rows - итерируемое (id, name, description, price, category, duration)"""
+        with self._lock:
+            self._clear()
+            category_index = {}
+            for position, (service_id, name, description, price, category, duration) in enumerate(rows):
+                category = category or 'Другое'
+                if category not in category_index:
+                    category_index[category] = len(self.categories)
+                    self.categories.append(category)
+                minutes = parse_duration(duration)
+                self.ids.append(service_id)
+                self.names.append(name)
+                self.descriptions.append(description)
+                self.prices.append(price or 0.0)
+                self.category_codes.append(category_index[category])
+                self.durations.append(-1 if minutes is None else minutes)
+                self.duration_texts.append(duration)
+
+                self.by_category.setdefault(category, []).append(position)
+                for label, low, high in PRICE_RANGES:
+                    if (price or 0) >= low and (high is None or (price or 0) < high):
+                        self.by_price.setdefault(label, []).append(position)
+                for label, low, high in DURATION_RANGES:
+                    if minutes is not None and low <= minutes and (high is None or minutes <= high):
+                        self.by_duration.setdefault(label, []).append(position)
+            self.loaded_at = time.time()
+
+    def row(self, position):
+        minutes = self.durations[position]
+        return ServiceRow(self.ids[position], self.names[position], self.descriptions[position],
+                          self.prices[position], self.categories[self.category_codes[position]],
+                          self.duration_texts[position], None if minutes < 0 else minutes)
+
+    def _matches(self, position, category, price_min, price_max, duration_max, text):
+        if category is not None and self.categories[self.category_codes[position]] != category:
+            return False
+        price = self.prices[position]
+        if price_min is not None and price < price_min:
+            return False
+        if price_max is not None and price > price_max:
+            return False
+        if duration_max is not None and not 0 <= self.durations[position] <= duration_max:
+            return False
+        if text and text not in self.names[position].lower() \
+                and text not in (self.descriptions[position] or '').lower():
+            return False
+        return True
+
+    def query(self, category=None, price_min=None, price_max=None, duration_max=None, text=None,
+              sort=None, limit=None, offset=0):
+        """Возвращает (строки, всего найдено, фасеты).
+
+        Счетчики фасета категорий считаются без фильтра по категории, чтобы
+        было видно, сколько услуг даст выбор другой категории.
+        """
+        text = (text or '').strip().lower() or None
+        with self._lock:
+            positions = range(len(self.ids))
+            if category is not None:
+                positions = self.by_category.get(category, [])
+            found = [p for p in positions
+                     if self._matches(p, None, price_min, price_max, duration_max, text)]
+
+            other = [p for p in range(len(self.ids))
+                     if self._matches(p, None, price_min, price_max, duration_max, text)]
+            facets = {
+                'category': {name: 0 for name in self.categories},
+                'price': {label: 0 for label, _, _ in PRICE_RANGES},
+                'duration': {label: 0 for label, _, _ in DURATION_RANGES},
+            }
+            for p in other:
+                facets['category'][self.categories[self.category_codes[p]]] += 1
+            found_set = set(found)
+            for label, members in self.by_price.items():
+                facets['price'][label] = sum(1 for p in members if p in found_set)
+            for label, members in self.by_duration.items():
+                facets['duration'][label] = sum(1 for p in members if p in found_set)
+
+            if sort in ('price', '-price'):
+                found.sort(key=lambda p: self.prices[p], reverse=sort == '-price')
+            elif sort == 'duration':
+                found.sort(key=lambda p: (self.durations[p] < 0, self.durations[p]))
+            elif sort == 'name':
+                found.sort(key=lambda p: self.names[p].lower())
+
+            total = len(found)
+            page = found[offset:offset + limit if limit else None]
+            return [self.row(p) for p in page], total, facets
+
+
+WEEKDAYS = ('пн', 'вт', 'ср', 'чт', 'пт', 'сб', 'вс')
+
+_DAY_NAME = r'(?<![а-яё])(?:пн|вт|ср|чт|пт|сб|вс)(?![а-яё])'
+# Группа дней: один день или дни через дефис ("пн", "пн-пт", "пн-ср-пт")
+_SCHEDULE_DAYS = re.compile(rf'{_DAY_NAME}(?:\s*-\s*{_DAY_NAME})*')
+_SCHEDULE_HOURS = re.compile(r'(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})')
+
+
+def parse_schedule(text):
+    """'Пн-Пт 9:00-18:00' -> ({0..4}, (540, 1080)).
+
+    Формат расписаний в базе:
+    - запятая (или пробел) разделяет перечисление: "Вт, Чт, Сб", "Пн-Пт 9:00-18:00, Сб 10:00-16:00";
+    - два дня через дефис - диапазон: "Пн-Пт", "Вт-Сб" (и через воскресенье: "Пт-Пн");
+    - три и больше дней через дефис - перечисление через день, как в данных
+      клиники: "Пн-Ср-Пт", "Вт-Чт-Сб". Понедельник и среду без вторника
+      пишут через запятую: "Пн, Ср" ("Пн-Ср" - это пн, вт, ср).
+    Часы - первый диапазон времени в строке.
+    """
+    text = (text or '').lower()
+    days = set()
+    for group in _SCHEDULE_DAYS.finditer(text):
+        indexes = [WEEKDAYS.index(name) for name in re.findall(_DAY_NAME, group.group(0))]
+        if len(indexes) == 2:
+            start, end = indexes
+            days.update(day % 7 for day in range(start, end + (7 if end < start else 0) + 1))
+        else:
+            days.update(indexes)
+    hours = None
+    match = _SCHEDULE_HOURS.search(text)
+    if match:
+        h1, m1, h2, m2 = (int(group) for group in match.groups())
+        hours = (h1 * 60 + m1, h2 * 60 + m2)
+    return days, hours
+
+
+DoctorRow = namedtuple('DoctorRow', 'id name specialization experience photo_url schedule')
+
+
+class DoctorDirectory:
+    def __init__(self, ttl=60, slot_minutes=30):
+        self.ttl = ttl
+        self.slot_minutes = slot_minutes
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        self.rows = []
+        self.specializations = []
+        self.experience = array('i')
+        self.work_hours = []
+        self.by_specialization = {}
+        self.by_weekday = {}
+
+    def is_stale(self):
+        return self.loaded_at is None or time.time() - self.loaded_at > self.ttl
+
+    def invalidate(self):
+        self.loaded_at = None
+
+    def load(self, rows):
+        """rows - итерируемое (id, name, specialization, experience, photo_url, schedule)"""
+        with self._lock:
+            self.rows = []
+            self.experience = array('i')
+            self.work_hours = []
+            self.by_specialization = {}
+            self.by_weekday = {day: [] for day in range(7)}
+            specializations = []
+            for position, row in enumerate(rows):
+                row = DoctorRow(*row)
+                self.rows.append(row)
+                self.experience.append(row.experience or 0)
+                if row.specialization and row.specialization not in specializations:
+                    specializations.append(row.specialization)
+                # "Терапевт, гастроэнтеролог" ищется по каждому слову отдельно
+                for token in (row.specialization or '').lower().split(','):
+                    token = token.strip()
+                    if token:
+                        self.by_specialization.setdefault(token, []).append(position)
+                days, hours = parse_schedule(row.schedule)
+                self.work_hours.append(hours)
+                for day in days:
+                    self.by_weekday[day].append(position)
+            self.specializations = specializations
+            self.loaded_at = time.time()
+
+    def query(self, specialization=None, min_experience=None, weekday=None):
+        """Позиции врачей, прошедших фильтры, в порядке загрузки"""
+        with self._lock:
+            candidates = set(range(len(self.rows)))
+            if specialization:
+                wanted = specialization.strip().lower()
+                matched = set()
+                for token, positions in self.by_specialization.items():
+                    if wanted in token:
+                        matched.update(positions)
+                candidates &= matched
+            if weekday is not None:
+                candidates &= set(self.by_weekday.get(weekday, []))
+            if min_experience:
+                candidates = {p for p in candidates if self.experience[p] >= min_experience}
+            return sorted(candidates)
+
+    def free_slots(self, position, day, busy_minutes, now=None):
+        """Свободные окна врача в этот день по порядку (генератор).
+
+        busy_minutes - множество минут от начала дня, на которые уже есть записи.
+        """
+        hours = self.work_hours[position]
+        if hours is None or position not in self.by_weekday.get(day.weekday(), []):
+            return
+        start, end = hours
+        earliest = start
+        if now is not None and now.date() == day:
+            earliest = max(start, now.hour * 60 + now.minute)
+        slot = start
+        while slot + self.slot_minutes <= end:
+            if slot >= earliest and not any(slot <= minute < slot + self.slot_minutes for minute in busy_minutes):
+                yield datetime.combine(day, datetime.min.time()) + timedelta(minutes=slot)
+            slot += self.slot_minutes
+
+    def next_free_slot(self, position, day, busy_minutes, now=None):
+        """Первое свободное окно врача в этот день или None"""
+        return next(self.free_slots(position, day, busy_minutes, now), None)
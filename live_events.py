@@ -0,0 +1,182 @@
+"""
+Живые обновления панелей сотрудников (Server-Sent Events)
+
+EventBroker раздает события подписчикам - по одной ограниченной очереди на
+открытую вкладку. Медленный клиент не копит память: при переполнении
+старые события выбрасываются, а клиент получает 'reset' и перечитывает
+страницу целиком. Доставку между процессами делает бэкенд: LocalBackend
+работает внутри одного процесса, SQLiteBackend передает события через
+общую таблицу, которую каждый процесс опрашивает одним потоком.
+"""
+import itertools
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+
+class Subscription:
+    def __init__(self, broker, channels, max_queue):
+        self.broker = broker
+        self.channels = set(channels)
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            # Клиент не успевает читать - освобождаем место и просим полную перезагрузку
+            self.overflowed = True
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.queue.put_nowait(message)
+
+    def get(self, timeout):
+        """Следующее событие или None, если за timeout ничего не пришло"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBackend:
+    """События видны только в текущем процессе"""
+
+    def start(self, deliver):
+        self.deliver = deliver
+
+    def publish(self, message):
+        self.deliver(message)
+
+
+class SQLiteBackend:
+    """События через таблицу SQLite: видят все процессы на одной машине"""
+
+    def __init__(self, db_path, poll_interval=0.5, keep_seconds=300, on_error=print):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.keep_seconds = keep_seconds
+        self.on_error = on_error
+        self._thread = None
+        folder = os.path.dirname(db_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                body TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            ''')
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def start(self, deliver):
+        self.deliver = deliver
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._poll_loop, name='events-poller', daemon=True)
+            self._thread.start()
+
+    def publish(self, message):
+        conn = self._connect()
+        try:
+            conn.execute('INSERT INTO events (body, created_at) VALUES (?, ?)',
+                         (json.dumps(message, ensure_ascii=False), time.time()))
+        finally:
+            conn.close()
+
+    def _poll_loop(self):
+        conn = None
+        last_id = None
+        last_cleanup = 0
+        while True:
+            # Ошибка (база занята, битое событие, сбой подписчика) не должна
+            # останавливать поток - иначе процесс молча перестанет получать события
+            try:
+                if conn is None:
+                    conn = self._connect()
+                if last_id is None:
+                    # Доставляем только события, появившиеся после старта процесса
+                    last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+                rows = conn.execute('SELECT id, body FROM events WHERE id > ? ORDER BY id', (last_id,)).fetchall()
+                for event_id, body in rows:
+                    # id сдвигается до доставки: событие, на котором упали, не повторяется бесконечно
+                    last_id = event_id
+                    self.deliver(json.loads(body))
+                if time.time() - last_cleanup > self.keep_seconds:
+                    conn.execute('DELETE FROM events WHERE created_at < ?', (time.time() - self.keep_seconds,))
+                    last_cleanup = time.time()
+            except Exception as e:
+                self.on_error(e)
+                if isinstance(e, sqlite3.Error) and conn is not None:
+                    conn.close()
+                    conn = None
+            time.sleep(self.poll_interval)
+
+
+class EventBroker:
+    def __init__(self, backend=None, max_queue=100):
+        self.backend = backend or LocalBackend()
+        self.max_queue = max_queue
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.backend.start(self._deliver)
+
+    def subscribe(self, channels):
+        subscription = Subscription(self, channels, self.max_queue)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscriptions)
+
+    def publish(self, channel, event, data):
+        self.backend.publish({'channel': channel, 'event': event, 'data': data})
+
+    def _deliver(self, message):
+        # Сериализуем один раз на все вкладки
+        message = dict(message, id=next(self._ids),
+                       payload=json.dumps(message['data'], ensure_ascii=False))
+        with self._lock:
+            subscriptions = [s for s in self._subscriptions if message['channel'] in s.channels]
+        for subscription in subscriptions:
+            subscription.put(message)
+
+    def stream(self, channels, heartbeat=15):
+        """Генератор текста SSE для одного клиента; комментарий-пинг раз в heartbeat секунд"""
+        subscription = self.subscribe(channels)
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                if subscription.overflowed:
+                    subscription.overflowed = False
+                    yield 'event: reset\ndata: {}\n\n'
+                message = subscription.get(heartbeat)
+                if message is None:
+                    yield ': ping\n\n'
+                    continue
+                yield f"id: {message['id']}\nevent: {message['event']}\ndata: {message['payload']}\n\n"
+        finally:
+            # Клиент закрыл соединение - сервер бросает GeneratorExit при следующей записи
+            subscription.close()
@@ -0,0 +1,152 @@
+"""
+Кэш страниц с защитой от "толпы" (single-flight)
+
+Когда запись кэша устаревает, пересчитывает ее только один запрос, а
+остальные в это время получают прежнее значение. Если прежнего значения
+нет, они ждут результат, а не запускают те же запросы к базе сами.
+Значения лежат в файлах, поэтому кэш и блокировки (flock на .lock-файле)
+общие для всех процессов на машине. В памяти процесса хранится копия,
+которая сверяется с файлом по времени изменения.
+
+Чтобы запись не устаревала у всех одновременно, используется вероятностное
+досрочное обновление (XFetch): чем ближе срок и чем дольше считалось
+значение, тем выше шанс, что очередной запрос обновит его заранее.
+"""
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: блокировка только между потоками одного процесса
+    fcntl = None
+
+_UNSAFE = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+class SingleFlightCache:
+    def __init__(self, cache_dir, ttl=60, stale_ttl=600, beta=1.0, wait_timeout=10):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        # Сколько после срока еще можно отдавать старое значение, пока его пересчитывают
+        self.stale_ttl = stale_ttl
+        self.beta = beta
+        self.wait_timeout = wait_timeout
+        self._memory = {}
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key, suffix):
+        return os.path.join(self.cache_dir, _UNSAFE.sub('_', key) + suffix)
+
+    def _read(self, key):
+        path = self._path(key, '.cache')
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            self._memory.pop(key, None)
+            return None
+        cached = self._memory.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            with open(path, encoding='utf-8') as f:
+                meta = json.loads(f.readline())
+                meta['value'] = f.read()
+        except (OSError, ValueError):
+            return None
+        self._memory[key] = (mtime, meta)
+        return meta
+
+    def _write(self, key, value, meta):
+        path = self._path(key, '.cache')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(json.dumps({k: v for k, v in meta.items() if k != 'value'}) + '\n')
+            f.write(value)
+        os.replace(path + '.tmp', path)
+
+    def _should_refresh(self, entry, now):
+        # XFetch: -log(rand) > 0, с редкими большими значениями - досрочное обновление
+        return now - entry['delta'] * self.beta * math.log(random.random() or 1e-12) >= entry['expires_at']
+
+    def _thread_lock(self, key):
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _acquire(self, key, blocking):
+        """Блокировка ключа между потоками и процессами; None, если занята (или истек таймаут)"""
+        thread_lock = self._thread_lock(key)
+        if not thread_lock.acquire(blocking, self.wait_timeout if blocking else -1):
+            return None
+        if fcntl is None:
+            return thread_lock, None
+        handle = open(self._path(key, '.lock'), 'a')
+        deadline = time.time() + self.wait_timeout
+        while True:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return thread_lock, handle
+            except OSError:
+                if not blocking or time.time() > deadline:
+                    handle.close()
+                    thread_lock.release()
+                    return None
+                time.sleep(0.02)
+
+    def _release(self, lock):
+        thread_lock, handle = lock
+        if handle is not None:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+        thread_lock.release()
+
+    def get(self, key, compute, ttl=None):
+        """Значение из кэша или compute() - но не больше одного compute() на ключ одновременно"""
+        ttl = self.ttl if ttl is None else ttl
+        requested_at = time.time()
+        entry = self._read(key)
+        if entry is not None and not self._should_refresh(entry, requested_at):
+            return entry['value']
+
+        lock = self._acquire(key, blocking=False)
+        if lock is None:
+            # Уже пересчитывает другой запрос: отдаем, что есть, пока не слишком старое
+            if entry is not None and requested_at < entry['stale_until']:
+                return entry['value']
+            lock = self._acquire(key, blocking=True)
+            if lock is None:
+                return compute()
+        try:
+            entry = self._read(key)
+            if entry is not None and entry['computed_at'] + entry['delta'] >= requested_at:
+                # Пока ждали блокировку, значение пересчитал другой процесс
+                return entry['value']
+            started = time.time()
+            value = compute()
+            finished = time.time()
+            self._write(key, value, {
+                'computed_at': started,
+                'delta': finished - started,
+                'expires_at': finished + ttl,
+                'stale_until': finished + ttl + self.stale_ttl,
+            })
+            return value
+        finally:
+            self._release(lock)
+
+    def invalidate(self, prefix=''):
+        """Помечает записи устаревшими, не удаляя: пока одна пересчитывается, остальным отдается старая"""
+        safe_prefix = _UNSAFE.sub('_', prefix)
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith('.cache') or not filename.startswith(safe_prefix):
+                continue
+            key = filename[:-len('.cache')]
+            entry = self._read(key)
+            if entry is not None and entry['expires_at'] > 0:
+                self._write(key, entry['value'], dict(entry, expires_at=0))
@@ -0,0 +1,133 @@
+"""
+Выборочный (sampling) профилировщик запросов
+
+Пока идут профилируемые запросы, фоновый поток раз в interval секунд
+снимает стек их потоков через sys._current_frames(). Сам запрос ничем не
+замедляется, кроме регистрации в начале и в конце. Стеки копятся по
+endpoint в свернутом виде (collapsed stacks) - этот формат понимают
+flamegraph.pl и speedscope.
+"""
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.enabled = False
+        self.sample_rate = 0.0
+        self.path_prefix = None
+        self.stacks = defaultdict(Counter)
+        self.requests = Counter()
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def configure(self, enabled=None, sample_rate=None, path_prefix=None, interval=None):
+        if enabled is not None:
+            self.enabled = bool(enabled)
+        if sample_rate is not None:
+            self.sample_rate = max(0.0, min(1.0, float(sample_rate)))
+        if path_prefix is not None:
+            self.path_prefix = path_prefix or None
+        if interval is not None:
+            self.interval = max(0.001, float(interval))
+
+    def should_profile(self, path):
+        if not self.enabled:
+            return False
+        if self.path_prefix and path.startswith(self.path_prefix):
+            return True
+        return random.random() < self.sample_rate
+
+    def start(self, endpoint):
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._active[thread_id] = endpoint or 'unknown'
+            self.requests[endpoint or 'unknown'] += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._sample_loop, name='profiler-sampler', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return thread_id
+
+    def stop(self, token):
+        with self._lock:
+            self._active.pop(token, None)
+
+    def _frame_name(self, frame):
+        code = frame.f_code
+        return f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}'
+
+    def _sample_loop(self):
+        while True:
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                # Профилируемых запросов нет - ждем, не тратя процессор
+                self._wakeup.clear()
+                self._wakeup.wait(5)
+                with self._lock:
+                    if not self._active:
+                        self._thread = None
+                        return
+                continue
+            frames = sys._current_frames()
+            for thread_id, endpoint in active.items():
+                frame = frames.get(thread_id)
+                names = []
+                while frame is not None and len(names) < self.max_depth:
+                    names.append(self._frame_name(frame))
+                    frame = frame.f_back
+                if names:
+                    stack = ';'.join(reversed(names))
+                    with self._lock:
+                        self.stacks[endpoint][stack] += 1
+            time.sleep(self.interval)
+
+    def reset(self):
+        with self._lock:
+            self.stacks = defaultdict(Counter)
+            self.requests = Counter()
+
+    def collapsed(self, endpoint=None):
+        """Свернутые стеки: 'endpoint;кадр;кадр N' на строку"""
+        with self._lock:
+            lines = []
+            for name, stacks in sorted(self.stacks.items()):
+                if endpoint and name != endpoint:
+                    continue
+                for stack, count in stacks.most_common():
+                    lines.append(f'{name};{stack} {count}')
+        return '\n'.join(lines) + ('\n' if lines else '')
+
+    def top_functions(self, endpoint=None, limit=20):
+        """Функции с наибольшим собственным (self) и полным (total) числом выборок"""
+        own = Counter()
+        total = Counter()
+        samples = 0
+        with self._lock:
+            for name, stacks in self.stacks.items():
+                if endpoint and name != endpoint:
+                    continue
+                for stack, count in stacks.items():
+                    frames = stack.split(';')
+                    samples += count
+                    # Номер строки отбрасываем, чтобы собрать функцию целиком
+                    functions = [frame.rsplit(':', 1)[0] for frame in frames]
+                    own[functions[-1]] += count
+                    for function in set(functions):
+                        total[function] += count
+        return {
+            'samples': samples,
+            'self': [{'function': f, 'samples': c, 'percent': round(100.0 * c / samples, 1)}
+                     for f, c in own.most_common(limit)] if samples else [],
+            'total': [{'function': f, 'samples': c, 'percent': round(100.0 * c / samples, 1)}
+                      for f, c in total.most_common(limit)] if samples else [],
+        }
@@ -0,0 +1,65 @@
+"""
+Облегченные модели чтения для списков
+
+Списки статей, новостей, врачей и услуг только читаются, поэтому вместо
+ORM-объектов (identity map, отслеживание изменений, ленивые связи)
+выбираются нужные столбцы сразу в именованные кортежи. Для API строки
+сериализуются в JSON напрямую, без промежуточного списка словарей.
+"""
+import json
+from collections import namedtuple
+from datetime import date, datetime
+from operator import attrgetter
+
+from sqlalchemy import select
+
+
+def row_type(name, *columns):
+    """Именованный кортеж с полями по ключам столбцов: row_type('DoctorRow', Doctor.id, Doctor.name)"""
+    row = namedtuple(name, [column.key for column in columns])
+    row.columns = columns
+    return row
+
+
+def fetch_rows(session, row, *criteria, order_by=None, limit=None):
+    """SELECT только столбцов row.columns; строки не попадают в сессию"""
+    statement = select(*row.columns).where(*criteria)
+    if order_by is not None:
+        statement = statement.order_by(*(order_by if isinstance(order_by, (list, tuple)) else [order_by]))
+    if limit is not None:
+        statement = statement.limit(limit)
+    return [row._make(values) for values in session.execute(statement)]
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} не сериализуется в JSON')
+
+
+_encode = json.JSONEncoder(ensure_ascii=False, default=_default).encode
+
+
+def rows_to_json(rows, fields):
+    """JSON-массив объектов из строк.
+
+    fields - имена атрибутов или пары (ключ, функция(строка)) для вычисляемых полей.
+    Ключи кодируются один раз, значения - по одному, без словаря на каждую строку.
+    """
+    keys = []
+    getters = []
+    for field in fields:
+        if isinstance(field, tuple):
+            key, getter = field
+        else:
+            key, getter = field, attrgetter(field)
+        keys.append(_encode(key) + ':')
+        getters.append(getter)
+    parts = []
+    for row in rows:
+        parts.append('{' + ','.join(key + _encode(getter(row)) for key, getter in zip(keys, getters)) + '}')
+    return '[' + ','.join(parts) + ']'
+
+
+def to_json(value):
+    return _encode(value)
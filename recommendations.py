@@ -0,0 +1,87 @@
+"""
+Похожие статьи на основе TF-IDF
+
+Векторы хранятся разреженно (словарь термин -> вес), сходство считается
+через инвертированный индекс, поэтому сравниваются только статьи с общими
+словами, а не все пары подряд.
+"""
+import math
+import re
+from collections import Counter, defaultdict
+
+_WORD = re.compile(r'[a-zа-яё]+', re.UNICODE)
+
+STOP_WORDS = {
+    'и', 'в', 'во', 'не', 'что', 'он', 'на', 'я', 'с', 'со', 'как', 'а', 'то', 'все', 'она', 'так',
+    'его', 'но', 'да', 'ты', 'к', 'у', 'же', 'вы', 'за', 'бы', 'по', 'только', 'ее', 'мне', 'было',
+    'вот', 'от', 'меня', 'еще', 'нет', 'о', 'из', 'ему', 'теперь', 'когда', 'даже', 'ну', 'ли',
+    'если', 'уже', 'или', 'ни', 'быть', 'был', 'него', 'до', 'вас', 'нибудь', 'опять', 'уж', 'вам',
+    'ведь', 'там', 'потом', 'себя', 'ничего', 'ей', 'может', 'они', 'тут', 'где', 'есть', 'надо',
+    'ней', 'для', 'мы', 'тебя', 'их', 'чем', 'была', 'сам', 'чтоб', 'без', 'будто', 'чего', 'раз',
+    'тоже', 'себе', 'под', 'будет', 'ж', 'тогда', 'кто', 'этот', 'того', 'потому', 'этого', 'какой',
+    'совсем', 'ним', 'здесь', 'этом', 'один', 'почти', 'мой', 'тем', 'чтобы', 'нее', 'сейчас',
+    'были', 'куда', 'зачем', 'всех', 'можно', 'при', 'об', 'также', 'это', 'эти', 'после', 'перед',
+}
+
+# Заголовок важнее текста
+TITLE_WEIGHT = 2
+
+
+def tokenize(text):
+    """Слова длиннее двух букв без стоп-слов, обрезанные до 6 символов (грубая замена стемминга)"""
+    words = _WORD.findall((text or '').lower().replace('ё', 'е'))
+    return [word[:6] for word in words if len(word) > 2 and word not in STOP_WORDS]
+
+
+def document_terms(title, content):
+    counts = Counter(tokenize(content))
+    for term in tokenize(title):
+        counts[term] += TITLE_WEIGHT
+    return counts
+
+
+class TfidfModel:
+    def __init__(self, documents):
+        """documents - итерируемое (id, title, content); читается один раз"""
+        self.term_counts = {}
+        doc_freq = Counter()
+        for doc_id, title, content in documents:
+            counts = document_terms(title, content)
+            self.term_counts[doc_id] = counts
+            doc_freq.update(counts.keys())
+
+        total = len(self.term_counts)
+        self.idf = {term: math.log((1 + total) / (1 + df)) + 1 for term, df in doc_freq.items()}
+        self.vectors = {doc_id: self._vector(counts) for doc_id, counts in self.term_counts.items()}
+
+        self.postings = defaultdict(list)
+        for doc_id, vector in self.vectors.items():
+            for term, weight in vector.items():
+                self.postings[term].append((doc_id, weight))
+
+    def _vector(self, counts):
+        vector = {term: (1 + math.log(count)) * self.idf.get(term, 1.0) for term, count in counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        if norm:
+            vector = {term: weight / norm for term, weight in vector.items()}
+        return vector
+
+    def scores(self, doc_id):
+        """Косинусное сходство doc_id со всеми статьями, у которых есть общие термины"""
+        result = defaultdict(float)
+        for term, weight in self.vectors.get(doc_id, {}).items():
+            for other_id, other_weight in self.postings[term]:
+                if other_id != doc_id:
+                    result[other_id] += weight * other_weight
+        return result
+
+    def neighbours(self, doc_id, top_n=5, min_score=0.01):
+        scored = self.scores(doc_id)
+        best = sorted(scored.items(), key=lambda item: (-item[1], item[0]))[:top_n]
+        return [(other_id, score) for other_id, score in best if score >= min_score]
+
+    def all_neighbours(self, top_n=5, batch_size=500):
+        """Генератор пачек [(id, соседи)] для полного пересчета"""
+        ids = sorted(self.vectors)
+        for i in range(0, len(ids), batch_size):
+            yield [(doc_id, self.neighbours(doc_id, top_n)) for doc_id in ids[i:i + batch_size]]
@@ -0,0 +1,122 @@
+"""
+Текст статей и новостей: Markdown -> безопасный HTML
+
+Поддерживается подмножество Markdown, которого хватает редакторам:
+заголовки (#, ##, ###), абзацы, нумерованные и маркированные списки,
+цитаты (>), **жирный**, *курсив*, `код` и ссылки [текст](адрес).
+Соседние строки абзаца разделяются <br> - так авторы привыкли писать.
+
+Весь текст экранируется до разметки, HTML из источника не пропускается,
+а ссылки разрешены только на http(s), mailto и адреса сайта. Поэтому
+результат не нужно дополнительно очищать. Рендер выполняется один раз
+при сохранении; content_hash меняется и при смене версии рендера.
+"""
+import hashlib
+import re
+from html import escape
+
+# Увеличить при изменении правил рендера - сохраненный HTML будет пересчитан
+RENDERER_VERSION = 1
+
+_HEADING = re.compile(r'^(#{1,3})\s+(.*)$')
+_ORDERED = re.compile(r'^\d+[.)]\s+(.*)$')
+_BULLET = re.compile(r'^[-*•]\s+(.*)$')
+_QUOTE = re.compile(r'^>\s?(.*)$')
+
+_CODE = re.compile(r'`([^`]+)`')
+_LINK = re.compile(r'\[([^\]]+)\]\(([^)\s]+)\)')
+_BOLD = re.compile(r'\*\*(.+?)\*\*')
+_ITALIC = re.compile(r'(?<![*\w])\*(?!\s)(.+?)(?<!\s)\*(?![*\w])')
+_SAFE_URL = re.compile(r'^(https?://|mailto:|/(?!/)|#)', re.IGNORECASE)
+
+
+def content_hash(source):
+    return hashlib.sha256(f'{RENDERER_VERSION}:{source or ""}'.encode('utf-8')).hexdigest()
+
+
+def _inline(text):
+    text = escape(text, quote=True)
+    codes = []
+
+    def keep_code(match):
+        codes.append(match.group(1))
+        return f'\x00{len(codes) - 1}\x00'
+
+    # Внутри `кода` разметка не действует
+    text = _CODE.sub(keep_code, text)
+
+    def link(match):
+        label, url = match.groups()
+        if not _SAFE_URL.match(url):
+            return label
+        external = url.lower().startswith(('http://', 'https://'))
+        rel = ' rel="nofollow noopener" target="_blank"' if external else ''
+        return f'<a href="{url}"{rel}>{label}</a>'
+
+    text = _LINK.sub(link, text)
+    text = _BOLD.sub(r'<strong>\1</strong>', text)
+    text = _ITALIC.sub(r'<em>\1</em>', text)
+    return re.sub('\x00(\\d+)\x00', lambda m: f'<code>{codes[int(m.group(1))]}</code>', text)
+
+
+def _blocks(source):
+    """Разбивает текст на блоки (вид, строки) по пустым строкам и смене вида строки"""
+    kind, lines = None, []
+    for raw in (source or '').replace('\r\n', '\n').split('\n'):
+        line = raw.strip()
+        if not line:
+            if lines:
+                yield kind, lines
+            kind, lines = None, []
+            continue
+        heading = _HEADING.match(line)
+        if heading:
+            if lines:
+                yield kind, lines
+            yield 'h', [heading]
+            kind, lines = None, []
+            continue
+        for line_kind, pattern in (('ol', _ORDERED), ('ul', _BULLET), ('quote', _QUOTE)):
+            match = pattern.match(line)
+            if match:
+                break
+        else:
+            line_kind, match = 'p', None
+        text = match.group(1) if match else line
+        if line_kind != kind and lines:
+            yield kind, lines
+            lines = []
+        kind = line_kind
+        lines.append(text)
+    if lines:
+        yield kind, lines
+
+
+def render(source):
+    parts = []
+    for kind, lines in _blocks(source):
+        if kind == 'h':
+            heading = lines[0]
+            # h1 занят заголовком статьи, поэтому # -> h2
+            level = min(len(heading.group(1)) + 1, 4)
+            parts.append(f'<h{level}>{_inline(heading.group(2))}</h{level}>')
+        elif kind in ('ol', 'ul'):
+            items = ''.join(f'<li>{_inline(line)}</li>' for line in lines)
+            parts.append(f'<{kind}>{items}</{kind}>')
+        elif kind == 'quote':
+            parts.append('<blockquote><p>' + '<br>'.join(_inline(line) for line in lines) + '</p></blockquote>')
+        else:
+            parts.append('<p>' + '<br>'.join(_inline(line) for line in lines) + '</p>')
+    return '\n'.join(parts)
+
+
+def plain_text(source):
+    """Текст без разметки - для анонсов и подсчета времени чтения"""
+    lines = []
+    for kind, block in _blocks(source):
+        if kind == 'h':
+            block = [block[0].group(2)]
+        for line in block:
+            line = _LINK.sub(r'\1', line)
+            lines.append(line.replace('*', '').replace('`', ''))
+    return '\n'.join(lines)
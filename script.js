@@ -8,11 +8,23 @@ document.addEventListener('DOMContentLoaded', function() {
     initSliders();
     initModals();
     initSearch();
+    initServiceWorker();
+    initAppointmentCalendar();
     
     // Проверка совместимости
     checkBrowserCompatibility();
 });
 
+// Офлайн-кэш страниц и статики (сам service worker генерирует сервер: /sw.js)
+function initServiceWorker() {
+    if (!('serviceWorker' in navigator)) return;
+    window.addEventListener('load', () => {
+        navigator.serviceWorker.register('/sw.js').catch(error => {
+            console.warn('Service worker не зарегистрирован:', error);
+        });
+    });
+}
+
 // Функции доступности
 function initAccessibility() {
     // Проверяем сохраненные настройки
@@ -329,16 +341,48 @@ function initSearch() {
     
     if (searchInput && searchForm) {
         let searchTimeout;
+        let lastQuery = '';
+        
+        // Список подсказок под полем поиска
+        const suggestList = document.createElement('ul');
+        suggestList.className = 'search-suggestions';
+        suggestList.style.display = 'none';
+        searchForm.appendChild(suggestList);
         
+        searchInput.setAttribute('autocomplete', 'off');
         searchInput.addEventListener('input', function() {
             clearTimeout(searchTimeout);
+            const query = this.value.trim();
             
-            if (this.value.length >= 3) {
-                searchTimeout = setTimeout(() => {
-                    // AJAX поиск (можно реализовать)
-                    console.log('Поиск:', this.value);
-                }, 500);
+            if (query.length < 2) {
+                suggestList.style.display = 'none';
+                return;
             }
+            
+            searchTimeout = setTimeout(async () => {
+                lastQuery = query;
+                const items = await makeAjaxRequest(`/api/suggest?q=${encodeURIComponent(query)}`);
+                // Ответ на устаревший запрос не показываем
+                if (!items || query !== lastQuery) {
+                    return;
+                }
+                suggestList.innerHTML = '';
+                items.forEach(item => {
+                    const li = document.createElement('li');
+                    const link = document.createElement('a');
+                    link.href = item.url;
+                    link.textContent = item.title;
+                    li.appendChild(link);
+                    suggestList.appendChild(li);
+                });
+                suggestList.style.display = items.length ? 'block' : 'none';
+            }, 150);
+        });
+        
+        searchInput.addEventListener('blur', function() {
+            setTimeout(() => {
+                suggestList.style.display = 'none';
+            }, 200);
         });
         
         // Автодополнение
@@ -421,6 +465,36 @@ async function makeAjaxRequest(url, method = 'GET', data = null) {
     }
 }
 
+// Несколько ресурсов API одним запросом (/api/batch).
+// parts - {ключ: {resource, params, fields}}; результат - {ключ: данные}.
+// Неизменившиеся части сервер не присылает (304 по ETag) - берем их из памяти.
+const batchCache = new Map();
+
+async function fetchBatch(parts) {
+    const ids = Object.keys(parts);
+    const keys = ids.map(id => JSON.stringify([parts[id].resource, parts[id].params || {}, parts[id].fields || []]));
+    const requests = ids.map((id, index) => {
+        const cached = batchCache.get(keys[index]);
+        return Object.assign({id: id}, parts[id], cached ? {if_none_match: cached.etag} : {});
+    });
+    const response = await makeAjaxRequest(`/api/batch?requests=${encodeURIComponent(JSON.stringify(requests))}`);
+    if (!response) return null;
+    
+    const result = {};
+    response.responses.forEach((part, index) => {
+        if (part.status === 304) {
+            result[part.id] = batchCache.get(keys[index]).body;
+        } else if (part.status === 200) {
+            batchCache.set(keys[index], {etag: part.etag, body: part.body});
+            result[part.id] = part.body;
+        } else {
+            console.error(`Batch: часть ${part.id} - ошибка ${part.status}`, part.body);
+            result[part.id] = null;
+        }
+    });
+    return result;
+}
+
 // Ленивая загрузка изображений
 function initLazyLoading() {
     if ('IntersectionObserver' in window) {
@@ -460,6 +534,17 @@ function initAppointmentCalendar() {
     if (calendarEl) {
         // Здесь можно интегрировать библиотеку календаря
         // Например, Flatpickr или native HTML5 datepicker
+        // Врачи, услуги и свободные окна - одним запросом; данные получает календарь через событие
+        const date = calendarEl.dataset.date || new Date().toISOString().slice(0, 10);
+        fetchBatch({
+            doctors: {resource: 'doctors', fields: ['id', 'name', 'specialization', 'photo_url']},
+            services: {resource: 'services', fields: ['id', 'name', 'price', 'duration']},
+            slots: {resource: 'slots', params: {date: date}, fields: ['id', 'slots']}
+        }).then(data => {
+            if (data) {
+                calendarEl.dispatchEvent(new CustomEvent('booking:data', {detail: data}));
+            }
+        });
     }
 }
 
@@ -475,3 +560,4 @@ window.increaseFont = increaseFont;
 window.decreaseFont = decreaseFont;
 window.toggleContrast = toggleContrast;
 window.showNotification = showNotification;
+window.fetchBatch = fetchBatch;
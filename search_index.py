@@ -0,0 +1,98 @@
+"""
+Префиксный индекс для подсказок поиска
+
+Отсортированный массив ключей + bisect. Целиком индекс строится через
+build (ключи добавляются в конец и сортируются один раз), а bisect со
+вставкой в середину - только для изменений по одному элементу. Для каждого заголовка в индекс
+попадает каждое его слово вместе с остатком строки, поэтому запрос
+"зуб" находит "Как правильно ухаживать за зубами собаки".
+"""
+import bisect
+import heapq
+import re
+import threading
+
+_WORD_START = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize(text):
+    return ' '.join((text or '').lower().replace('ё', 'е').split())
+
+
+class PrefixIndex:
+    def __init__(self, max_scan=500):
+        # Сколько совпадений максимум просматривать при ранжировании коротких префиксов
+        self.max_scan = max_scan
+        self._keys = []
+        self._entries = []
+        self._by_item = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._by_item)
+
+    def _key_variants(self, label):
+        text = normalize(label)
+        return {text[match.start():] for match in _WORD_START.finditer(text)}
+
+    def build(self, items):
+        """Заменяет содержимое индекса; items - (kind, item_id, label, weight)"""
+        # Повтор элемента во входных данных заменяет прежний, как в add
+        latest = {(kind, item_id): (label, weight) for kind, item_id, label, weight in items}
+        pairs = []
+        by_item = {}
+        for (kind, item_id), (label, weight) in latest.items():
+            entry = dict(type=kind, id=item_id, title=label, weight=weight or 0)
+            keys = [(variant, kind, item_id) for variant in self._key_variants(label)]
+            pairs.extend((key, entry) for key in keys)
+            by_item[(kind, item_id)] = keys
+        pairs.sort(key=lambda pair: pair[0])
+        with self._lock:
+            self._keys = [key for key, _ in pairs]
+            self._entries = [entry for _, entry in pairs]
+            self._by_item = by_item
+
+    def add(self, kind, item_id, label, weight=0, **extra):
+        """Добавляет или заменяет элемент (kind, item_id)"""
+        with self._lock:
+            self.remove(kind, item_id)
+            entry = dict(extra, type=kind, id=item_id, title=label, weight=weight or 0)
+            keys = []
+            for variant in self._key_variants(label):
+                key = (variant, kind, item_id)
+                position = bisect.bisect_left(self._keys, key)
+                self._keys.insert(position, key)
+                self._entries.insert(position, entry)
+                keys.append(key)
+            self._by_item[(kind, item_id)] = keys
+
+    def remove(self, kind, item_id):
+        with self._lock:
+            for key in self._by_item.pop((kind, item_id), []):
+                position = bisect.bisect_left(self._keys, key)
+                if position < len(self._keys) and self._keys[position] == key:
+                    del self._keys[position]
+                    del self._entries[position]
+
+    def clear(self):
+        with self._lock:
+            self._keys = []
+            self._entries = []
+            self._by_item = {}
+
+    def search(self, query, limit=8):
+        """Top-k элементов, у которых какое-либо слово начинается с query"""
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        with self._lock:
+            start = bisect.bisect_left(self._keys, (prefix,))
+            end = min(start + self.max_scan, len(self._keys))
+            seen = {}
+            for position in range(start, end):
+                if not self._keys[position][0].startswith(prefix):
+                    break
+                entry = self._entries[position]
+                seen[(entry['type'], entry['id'])] = entry
+        best = heapq.nlargest(limit, seen.values(), key=lambda e: (e['weight'], -len(e['title'])))
+        return [{k: v for k, v in entry.items() if k != 'weight'} for entry in best]
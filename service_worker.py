@@ -0,0 +1,178 @@
+"""
+Генерация service worker (/sw.js)
+
+Список предзагрузки строится по статическим файлам (css, js, шрифты,
+иконки) и страницам "оболочки" сайта. Версия - хэш содержимого этих
+файлов и шаблонов: после выкладки с изменениями меняется имя кэшей, и
+новый service worker удаляет старые.
+
+Стратегии:
+- статика - сначала кэш;
+- статьи, новости, услуги, врачи, контакты - отдать из кэша и обновить
+  в фоне (stale-while-revalidate);
+- запись, API - сначала сеть, кэш только без сети;
+- личный кабинет и панели сотрудников - только сеть, в кэш не попадают;
+  так же и любые ответы с Cache-Control: private или no-store;
+- POST и переключатели оформления/входа сбрасывают кэш страниц.
+"""
+import hashlib
+import json
+import os
+
+PRECACHE_EXTENSIONS = ('.css', '.js', '.woff', '.woff2', '.ico', '.svg', '.png')
+# Крупные картинки кладутся в кэш при первом показе, а не заранее
+PRECACHE_MAX_BYTES = 200 * 1024
+
+
+def _files(folder, extensions=None):
+    if not folder or not os.path.isdir(folder):
+        return
+    for root, _, names in os.walk(folder):
+        for name in sorted(names):
+            if extensions is None or name.lower().endswith(extensions):
+                yield os.path.join(root, name)
+
+
+def build_manifest(static_folder, static_url_path, template_folder, shell_pages):
+    """{'version': ..., 'static': [url, ...], 'pages': [url, ...]}"""
+    digest = hashlib.sha256()
+    precache = []
+    for path in _files(static_folder, PRECACHE_EXTENSIONS):
+        if os.path.getsize(path) > PRECACHE_MAX_BYTES:
+            continue
+        relative = os.path.relpath(path, static_folder).replace(os.sep, '/')
+        precache.append(f'{static_url_path}/{relative}')
+        with open(path, 'rb') as f:
+            digest.update(relative.encode('utf-8') + f.read())
+    # Шаблоны меняют разметку страниц из кэша - тоже входят в версию
+    for path in _files(template_folder, ('.html',)):
+        with open(path, 'rb') as f:
+            digest.update(os.path.basename(path).encode('utf-8') + f.read())
+    # И сам код worker: новые правила кэширования должны удалить кэши старой версии
+    digest.update(_WORKER_JS.encode('utf-8'))
+    return {'version': digest.hexdigest()[:12], 'static': precache, 'pages': list(shell_pages),
+            'static_url_path': static_url_path}
+
+
+def render(manifest, swr_prefixes, network_first_prefixes, private_prefixes, reset_prefixes, offline_page):
+    config = {
+        'version': manifest['version'],
+        'static': manifest['static'],
+        'staticPrefix': manifest['static_url_path'] + '/',
+        'pages': manifest['pages'],
+        'swr': swr_prefixes,
+        'networkFirst': network_first_prefixes,
+        'private': private_prefixes,
+        'reset': reset_prefixes,
+        'offlinePage': offline_page,
+    }
+    return f'const CONFIG = {json.dumps(config, ensure_ascii=False)};\n' + _WORKER_JS
+
+
+_WORKER_JS = r"""
+// Сгенерировано сервером (service_worker.py) - не редактировать вручную
+const STATIC_CACHE = `vetclinic-static-${CONFIG.version}`;
+const PAGES_CACHE = `vetclinic-pages-${CONFIG.version}`;
+const RUNTIME_CACHE = `vetclinic-runtime-${CONFIG.version}`;
+
+function precache(cacheName, urls) {
+    // Страница или файл могут не загрузиться - остальное все равно кэшируем
+    return caches.open(cacheName).then(cache => Promise.all(urls.map(url => cache.add(url).catch(() => null))));
+}
+
+self.addEventListener('install', event => {
+    event.waitUntil(Promise.all([
+        // Страница для офлайна лежит со статикой: кэш страниц сбрасывается при входе и выходе
+        precache(STATIC_CACHE, CONFIG.static.concat([CONFIG.offlinePage])),
+        precache(PAGES_CACHE, CONFIG.pages)
+    ]).then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', event => {
+    const current = [STATIC_CACHE, PAGES_CACHE, RUNTIME_CACHE];
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(keys
+                .filter(key => key.startsWith('vetclinic-') && !current.includes(key))
+                .map(key => caches.delete(key))))
+            .then(() => self.clients.claim())
+    );
+});
+
+function matches(path, prefixes) {
+    return prefixes.some(prefix => prefix === '/' ? path === '/' : path.startsWith(prefix));
+}
+
+// Персональные ответы сервер помечает private/no-store - их в кэш не кладем
+function cacheable(response) {
+    const control = (response.headers.get('Cache-Control') || '').toLowerCase();
+    return response.ok && !control.includes('private') && !control.includes('no-store');
+}
+
+function staleWhileRevalidate(request) {
+    return caches.open(PAGES_CACHE).then(cache => cache.match(request).then(cached => {
+        const network = fetch(request).then(response => {
+            if (cacheable(response)) cache.put(request, response.clone());
+            return response;
+        });
+        if (cached) {
+            network.catch(() => null);
+            return cached;
+        }
+        return network.catch(() => offlineFallback(request));
+    }));
+}
+
+function networkFirst(request) {
+    return fetch(request).then(response => {
+        if (cacheable(response) && request.mode === 'navigate') {
+            const copy = response.clone();
+            caches.open(PAGES_CACHE).then(cache => cache.put(request, copy));
+        }
+        return response;
+    }).catch(() => caches.match(request).then(cached => cached || offlineFallback(request)));
+}
+
+function cacheFirst(request) {
+    return caches.match(request).then(cached => cached || fetch(request).then(response => {
+        if (response.ok) {
+            const copy = response.clone();
+            caches.open(RUNTIME_CACHE).then(cache => cache.put(request, copy));
+        }
+        return response;
+    }));
+}
+
+function networkOnly(request) {
+    return fetch(request).catch(() => offlineFallback(request));
+}
+
+function offlineFallback(request) {
+    if (request.mode === 'navigate') {
+        return caches.match(CONFIG.offlinePage).then(page => page || Response.error());
+    }
+    return Response.error();
+}
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    const url = new URL(request.url);
+    // Чужие домены и поток живых обновлений (SSE) идут мимо service worker
+    if (url.origin !== self.location.origin || request.headers.get('Accept') === 'text/event-stream') return;
+
+    // Вход, выход, смена оформления, отправка форм - страницы в кэше больше не актуальны
+    if (request.method !== 'GET' || matches(url.pathname, CONFIG.reset)) {
+        event.respondWith(caches.delete(PAGES_CACHE).then(() => fetch(request)));
+        return;
+    }
+    if (url.pathname.startsWith(CONFIG.staticPrefix)) {
+        event.respondWith(cacheFirst(request));
+    } else if (matches(url.pathname, CONFIG.private)) {
+        event.respondWith(networkOnly(request));
+    } else if (matches(url.pathname, CONFIG.networkFirst)) {
+        event.respondWith(networkFirst(request));
+    } else if (matches(url.pathname, CONFIG.swr)) {
+        event.respondWith(staleWhileRevalidate(request));
+    }
+});
+"""
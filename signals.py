@@ -0,0 +1,14 @@
+"""
+Сигналы приложения (blinker)
+
+На них подписываются кэши, счетчики и живые обновления панелей,
+чтобы не опрашивать базу после каждого изменения.
+"""
+from blinker import Namespace
+
+_signals = Namespace()
+
+# kwargs: appointment - словарь с полями записи
+appointment_created = _signals.signal('appointment-created')
+# kwargs: appointment - словарь с полями записи, old_status - прежний статус
+appointment_status_changed = _signals.signal('appointment-status-changed')
@@ -0,0 +1,127 @@
+"""
+Генерация XML-карты сайта в файлы
+
+URL-адреса приходят генератором и сразу пишутся в файл, в памяти не
+держится весь список. После 50 000 адресов начинается новый файл, а
+sitemap.xml становится индексом (sitemapindex) со ссылками на части.
+
+Файлы общие для всех процессов сайта, поэтому генерация идет под flock
+на sitemap.lock: временные .tmp-файлы двух процессов не перемешиваются.
+"""
+import os
+import threading
+from xml.sax.saxutils import escape
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: блокировка только между потоками одного процесса
+    fcntl = None
+
+MAX_URLS_PER_FILE = 50000
+
+_URLSET_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                  '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+_INDEX_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                 '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+
+
+class SitemapCache:
+    def __init__(self, cache_dir, max_urls=MAX_URLS_PER_FILE):
+        self.cache_dir = cache_dir
+        self.max_urls = max_urls
+        self.version = None
+        self._lock = threading.Lock()
+
+    def path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _version_file(self):
+        return self.path('version.txt')
+
+    def is_fresh(self, version):
+        if self.version == version:
+            return True
+        # Файлы мог уже сгенерировать другой процесс
+        try:
+            with open(self._version_file(), encoding='utf-8') as f:
+                stored = f.read().strip()
+        except OSError:
+            return False
+        if stored == version and os.path.exists(self.path('sitemap.xml')):
+            self.version = version
+            return True
+        return False
+
+    def ensure(self, version, urls, part_url):
+        """Перегенерирует файлы, если версия контента изменилась.
+
+        urls - функция без аргументов, возвращающая итератор (loc, lastmod);
+        part_url(n) - абсолютный адрес n-й части для индекса.
+        """
+        if self.is_fresh(version):
+            return
+        with self._lock:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            handle = open(self.path('sitemap.lock'), 'a')
+            try:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_EX)
+                # Пока ждали блокировку, файлы мог сгенерировать другой процесс
+                if self.is_fresh(version):
+                    return
+                self._generate(urls(), part_url)
+                with open(self._version_file() + '.tmp', 'w', encoding='utf-8') as f:
+                    f.write(version)
+                os.replace(self._version_file() + '.tmp', self._version_file())
+                self.version = version
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+                handle.close()
+
+    def _generate(self, urls, part_url):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        parts = 0
+        count = 0
+        current = None
+        for loc, lastmod in urls:
+            if current is None or count >= self.max_urls:
+                if current is not None:
+                    self._close_part(current, parts)
+                parts += 1
+                count = 0
+                current = open(self.path(f'sitemap-{parts}.xml.tmp'), 'w', encoding='utf-8')
+                current.write(_URLSET_HEADER)
+            current.write(f'  <url><loc>{escape(loc)}</loc>')
+            if lastmod:
+                current.write(f'<lastmod>{lastmod.strftime("%Y-%m-%d")}</lastmod>')
+            current.write('</url>\n')
+            count += 1
+        if current is None:
+            parts = 1
+            current = open(self.path('sitemap-1.xml.tmp'), 'w', encoding='utf-8')
+            current.write(_URLSET_HEADER)
+        self._close_part(current, parts)
+
+        if parts == 1:
+            # Все помещается в один файл - он и есть sitemap.xml
+            os.replace(self.path('sitemap-1.xml'), self.path('sitemap.xml'))
+        else:
+            with open(self.path('sitemap.xml.tmp'), 'w', encoding='utf-8') as f:
+                f.write(_INDEX_HEADER)
+                for n in range(1, parts + 1):
+                    f.write(f'  <sitemap><loc>{escape(part_url(n))}</loc></sitemap>\n')
+                f.write('</sitemapindex>\n')
+            os.replace(self.path('sitemap.xml.tmp'), self.path('sitemap.xml'))
+
+        # Удаляем части, оставшиеся от прошлой, более длинной генерации
+        n = parts + 1
+        while os.path.exists(self.path(f'sitemap-{n}.xml')):
+            os.remove(self.path(f'sitemap-{n}.xml'))
+            n += 1
+
+    def _close_part(self, handle, number):
+        handle.write('</urlset>\n')
+        handle.close()
+        os.replace(self.path(f'sitemap-{number}.xml.tmp'), self.path(f'sitemap-{number}.xml'))
@@ -0,0 +1,137 @@
+"""
+Журнал медленных SQL-запросов
+
+Подключается к событиям движка SQLAlchemy. Запросы дольше порога
+записываются вместе с формой параметров, длительностью, endpoint и
+планом EXPLAIN QUERY PLAN. Одинаковые запросы (после замены литералов на ?)
+сливаются в одну запись; хранятся последние capacity записей.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_statement(statement):
+    text = _STRING.sub('?', statement)
+    text = _NUMBER.sub('?', text)
+    text = _IN_LIST.sub('(?, ...)', text)
+    return _SPACES.sub(' ', text).strip()
+
+
+def parameter_shape(parameters, executemany):
+    """Типы параметров без значений (значения могут содержать личные данные)"""
+    if executemany:
+        rows = list(parameters or [])
+        first = parameter_shape(rows[0], False) if rows else []
+        return {'rows': len(rows), 'types': first}
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    return [type(value).__name__ for value in (parameters or ())]
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms=100, capacity=200, explain=True):
+        self.threshold_ms = threshold_ms
+        self.capacity = capacity
+        self.explain = explain
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._endpoint_getter = lambda: None
+
+    def install(self, engine, endpoint_getter=None):
+        if endpoint_getter is not None:
+            self._endpoint_getter = endpoint_getter
+        event.listen(engine, 'before_cursor_execute', self._before)
+        event.listen(engine, 'after_cursor_execute', self._after)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        # Время начала - на контексте выполнения этого запроса: если запрос упал,
+        # after_cursor_execute не вызовется, и ничего не останется на соединении
+        context._query_started = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_query_started', None)
+        if started is None:
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms >= self.threshold_ms:
+            self.record(statement, parameters, executemany, elapsed_ms, cursor)
+
+    def _explain(self, cursor, statement, parameters, executemany):
+        if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            return None
+        if executemany:
+            parameters = list(parameters)[0] if parameters else ()
+        try:
+            # Курсор DBAPI напрямую, чтобы EXPLAIN не попал в события и в журнал
+            explain_cursor = cursor.connection.cursor()
+            try:
+                explain_cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters or ())
+                return [row[-1] for row in explain_cursor.fetchall()]
+            finally:
+                explain_cursor.close()
+        except Exception as e:
+            return [f'EXPLAIN не выполнен: {e}']
+
+    def record(self, statement, parameters, executemany, elapsed_ms, cursor=None):
+        key = normalize_statement(statement)
+        try:
+            endpoint = self._endpoint_getter()
+        except Exception:
+            endpoint = None
+        with self._lock:
+            entry = self.entries.get(key)
+            need_plan = entry is None or entry['plan'] is None
+        plan = None
+        if need_plan and self.explain and cursor is not None:
+            plan = self._explain(cursor, statement, parameters, executemany)
+
+        with self._lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                entry = {
+                    'statement': key,
+                    'count': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'endpoints': {},
+                    'plan': None,
+                }
+            entry['count'] += 1
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+            entry['last_ms'] = elapsed_ms
+            entry['last_seen'] = time.time()
+            entry['parameters'] = parameter_shape(parameters, executemany)
+            endpoint = endpoint or '-'
+            entry['endpoints'][endpoint] = entry['endpoints'].get(endpoint, 0) + 1
+            if plan is not None:
+                entry['plan'] = plan
+            # Самая свежая запись - в конце; при переполнении вытесняется самая старая
+            self.entries[key] = entry
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def snapshot(self, order_by='total_ms'):
+        with self._lock:
+            entries = [dict(entry, endpoints=dict(entry['endpoints'])) for entry in self.entries.values()]
+        for entry in entries:
+            entry['avg_ms'] = round(entry['total_ms'] / entry['count'], 2)
+            entry['total_ms'] = round(entry['total_ms'], 2)
+            entry['max_ms'] = round(entry['max_ms'], 2)
+            entry['last_ms'] = round(entry['last_ms'], 2)
+        if order_by in ('total_ms', 'max_ms', 'avg_ms', 'count', 'last_seen'):
+            entries.sort(key=lambda entry: entry[order_by], reverse=True)
+        return entries
+
+    def reset(self):
+        with self._lock:
+            self.entries.clear()
@@ -0,0 +1,335 @@
+"""
+Фоновая очередь задач для уведомлений (email, SMS, сообщения с формы контактов)
+
+Задачи хранятся в отдельной SQLite-таблице и выполняются рабочими потоками,
+поэтому исходящие письма и SMS не задерживают ответ на запрос. Раз в
+maintenance_interval секунд один из рабочих потоков возвращает в очередь
+зависшие задачи и удаляет выполненные старше keep_done секунд.
+"""
+import json
+import os
+import random
+import smtplib
+import sqlite3
+import threading
+import time
+import traceback
+from email.message import EmailMessage
+
+
+class JobQueue:
+    """Очередь задач с повторами (экспоненциальная задержка) и dead-letter статусом"""
+
+    def __init__(self, db_path, max_attempts=5, base_delay=2.0, max_delay=600.0,
+                 poll_interval=1.0, stale_after=300.0, keep_done=7 * 86400, maintenance_interval=60.0):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        # stale_after должен быть больше времени самой долгой задачи: running дольше - считается зависшей
+        self.stale_after = stale_after
+        self.keep_done = keep_done
+        self.maintenance_interval = maintenance_interval
+        self.handlers = {}
+        # Задачи, которые выполняются в этом процессе, - их recover_stale не трогает
+        self._running = set()
+        self._running_lock = threading.Lock()
+        self._maintained_at = 0
+        self._threads = []
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        folder = os.path.dirname(self.db_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                run_at REAL NOT NULL,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_jobs_status_run_at ON jobs (status, run_at)')
+        finally:
+            conn.close()
+
+    def task(self, kind):
+        """Декоратор для регистрации обработчика задач указанного типа"""
+        def decorator(func):
+            self.handlers[kind] = func
+            return func
+        return decorator
+
+    def enqueue(self, kind, payload, delay=0):
+        now = time.time()
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, payload, status, run_at, created_at, updated_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?)",
+                (kind, json.dumps(payload, ensure_ascii=False), now + delay, now, now)
+            )
+            job_id = cursor.lastrowid
+        finally:
+            conn.close()
+        self._wakeup.set()
+        return job_id
+
+    def enqueue_coalesced(self, kind, payload, merge, delay=0):
+        """Как enqueue, но если задача этого типа еще ждет в очереди - payload
+        объединяется с ней (merge(старый, новый)) вместо новой задачи.
+
+        Срок выполнения ожидающей задачи не сдвигается: серия изменений за
+        время delay превращается в одну задачу, но и не откладывает ее бесконечно.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                "SELECT id, payload FROM jobs WHERE kind = ? AND status = 'queued' ORDER BY run_at LIMIT 1", (kind,)
+            ).fetchone()
+            if row is None:
+                job_id = conn.execute(
+                    "INSERT INTO jobs (kind, payload, status, run_at, created_at, updated_at) "
+                    "VALUES (?, ?, 'queued', ?, ?, ?)",
+                    (kind, json.dumps(payload, ensure_ascii=False), now + delay, now, now)
+                ).lastrowid
+            else:
+                job_id = row['id']
+                merged = merge(json.loads(row['payload']), payload)
+                conn.execute("UPDATE jobs SET payload = ?, updated_at = ? WHERE id = ?",
+                             (json.dumps(merged, ensure_ascii=False), now, job_id))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        self._wakeup.set()
+        return job_id
+
+    def _claim(self):
+        """Атомарно забирает одну готовую к выполнению задачу"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' AND run_at <= ? "
+                "ORDER BY run_at LIMIT 1", (now,)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (now, row['id'])
+            )
+            conn.execute('COMMIT')
+            return row
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def _backoff(self, attempts):
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.8, 1.2)
+
+    def _finish(self, job, error=None):
+        now = time.time()
+        attempts = job['attempts'] + 1
+        conn = self._connect()
+        try:
+            if error is None:
+                conn.execute("UPDATE jobs SET status = 'done', last_error = NULL, updated_at = ? WHERE id = ?",
+                             (now, job['id']))
+            elif attempts >= self.max_attempts:
+                conn.execute("UPDATE jobs SET status = 'dead', last_error = ?, updated_at = ? WHERE id = ?",
+                             (error, now, job['id']))
+            else:
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', last_error = ?, run_at = ?, updated_at = ? WHERE id = ?",
+                    (error, now + self._backoff(attempts), now, job['id'])
+                )
+        finally:
+            conn.close()
+
+    def run_once(self):
+        """Выполняет одну задачу. Возвращает False, если очередь пуста"""
+        job = self._claim()
+        if job is None:
+            return False
+        handler = self.handlers.get(job['kind'])
+        with self._running_lock:
+            self._running.add(job['id'])
+        try:
+            if handler is None:
+                raise LookupError(f"Нет обработчика для задачи '{job['kind']}'")
+            handler(json.loads(job['payload']))
+        except Exception:
+            self._finish(job, traceback.format_exc(limit=5))
+        else:
+            self._finish(job)
+        finally:
+            with self._running_lock:
+                self._running.discard(job['id'])
+        return True
+
+    def run_pending(self):
+        """Выполняет все готовые задачи в текущем потоке (удобно в тестах)"""
+        count = 0
+        while self.run_once():
+            count += 1
+        return count
+
+    def recover_stale(self):
+        """Возвращает в очередь задачи, зависшие в статусе running после падения процесса"""
+        with self._running_lock:
+            running = list(self._running)
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'queued' WHERE status = 'running' AND updated_at < ? "
+                f"AND id NOT IN ({', '.join('?' * len(running))})",
+                (time.time() - self.stale_after, *running)
+            )
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def purge_done(self):
+        """Удаляет выполненные задачи старше keep_done секунд; dead-letter остается для разбора"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute("DELETE FROM jobs WHERE status = 'done' AND updated_at < ?",
+                                  (time.time() - self.keep_done,))
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def maintain(self, force=False):
+        """recover_stale и purge_done не чаще раза в maintenance_interval секунд (в одном потоке)"""
+        with self._running_lock:
+            if not force and time.time() - self._maintained_at < self.maintenance_interval:
+                return False
+            self._maintained_at = time.time()
+        self.recover_stale()
+        self.purge_done()
+        return True
+
+    def requeue_dead(self, job_id=None):
+        """Повторно ставит в очередь задачи из dead-letter"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            if job_id is None:
+                cursor = conn.execute(
+                    "UPDATE jobs SET status = 'queued', attempts = 0, run_at = ?, updated_at = ? WHERE status = 'dead'",
+                    (now, now))
+            else:
+                cursor = conn.execute(
+                    "UPDATE jobs SET status = 'queued', attempts = 0, run_at = ?, updated_at = ? "
+                    "WHERE status = 'dead' AND id = ?", (now, now, job_id))
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+            return {row[0]: row[1] for row in rows}
+        finally:
+            conn.close()
+
+    def _worker(self):
+        while not self._stop.is_set():
+            try:
+                self.maintain()
+                if self.run_once():
+                    continue
+            except sqlite3.OperationalError:
+                # База занята другим процессом - попробуем позже
+                pass
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def start(self, workers=2):
+        if self._threads:
+            return
+        self.maintain(force=True)
+        self._stop.clear()
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+
+class SMTPMailer:
+    """Отправка писем через SMTP-сервер"""
+
+    def __init__(self, host, port=25, username=None, password=None, use_tls=False,
+                 sender='noreply@vetclinic.ru', timeout=10):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.sender = sender
+        self.timeout = timeout
+
+    def send(self, to, subject, body):
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = to
+        message['Subject'] = subject
+        message.set_content(body)
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as server:
+            if self.use_tls:
+                server.starttls()
+            if self.username:
+                server.login(self.username, self.password)
+            server.send_message(message)
+
+
+class MemoryOutbox:
+    """Локальная замена SMTP/SMS-шлюза для разработки и тестов: сообщения копятся в списке"""
+
+    def __init__(self):
+        self.messages = []
+        self._lock = threading.Lock()
+
+    def send(self, to, subject, body):
+        with self._lock:
+            self.messages.append({'to': to, 'subject': subject, 'body': body})
+
+    def clear(self):
+        with self._lock:
+            self.messages = []
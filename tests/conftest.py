@@ -0,0 +1,31 @@
+"""
+Общая фикстура: приложение, импортированное из копии в temp-каталоге
+
+База (instance/vetclinic.db) создается рядом с копией и не затрагивает рабочую.
+"""
+import importlib
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def vet_app(tmp_path, monkeypatch):
+    for name in os.listdir(ROOT):
+        if name.endswith('.py'):
+            shutil.copy(os.path.join(ROOT, name), tmp_path / name)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    for name in list(sys.modules):
+        if name == 'app':
+            del sys.modules[name]
+    module = importlib.import_module('app')
+    # Шаблоны в тестах не нужны - проверяются данные, а не разметка
+    monkeypatch.setattr(module, 'render_template', lambda *args, **kwargs: '')
+    with module.app.app_context():
+        module.db.create_all()
+    yield module
+    sys.modules.pop('app', None)
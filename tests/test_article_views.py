@@ -0,0 +1,22 @@
+"""
+Просмотр статьи попадает в агрегаты отчетов (DailySiteStat.article_views)
+"""
+from datetime import datetime
+
+
+def test_article_view_counted_in_site_rollup(vet_app):
+    db, Article, DailySiteStat = vet_app.db, vet_app.Article, vet_app.DailySiteStat
+    with vet_app.app.app_context():
+        article = Article(title='Статья', content='Текст статьи', is_published=True, views=0)
+        db.session.add(article)
+        db.session.commit()
+        article_id = article.id
+
+    client = vet_app.app.test_client()
+    assert client.get(f'/article/{article_id}').status_code == 200
+    assert client.get(f'/article/{article_id}').status_code == 200
+
+    with vet_app.app.app_context():
+        assert db.session.get(Article, article_id).views == 2
+        stat = db.session.get(DailySiteStat, datetime.utcnow().date())
+        assert stat is not None and stat.article_views == 2
@@ -0,0 +1,17 @@
+"""
+Агрегаты записей (DailyAppointmentStat): строки с нулевым счетчиком не остаются
+"""
+from datetime import datetime, timedelta
+
+
+def test_status_change_removes_emptied_rollup_row(vet_app):
+    db, Appointment, DailyAppointmentStat = vet_app.db, vet_app.Appointment, vet_app.DailyAppointmentStat
+    with vet_app.app.app_context():
+        appointment = Appointment(date_time=datetime.now() + timedelta(days=1), status='pending')
+        db.session.add(appointment)
+        db.session.commit()
+        assert [(row.status, row.count) for row in DailyAppointmentStat.query] == [('pending', 1)]
+
+        appointment.status = 'confirmed'
+        db.session.commit()
+        assert [(row.status, row.count) for row in DailyAppointmentStat.query] == [('confirmed', 1)]
@@ -0,0 +1,48 @@
+"""
+Разбор расписания врача (catalog.parse_schedule): форматы из данных клиники
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import parse_schedule  # noqa: E402
+
+
+@pytest.mark.parametrize('text, days, hours', [
+    # Расписания врачей из начальных данных (run.py)
+    ('Пн-Пт 9:00-18:00', {0, 1, 2, 3, 4}, (540, 1080)),
+    ('Вт-Сб 10:00-19:00', {1, 2, 3, 4, 5}, (600, 1140)),
+    ('Пн-Ср-Пт 8:00-17:00', {0, 2, 4}, (480, 1020)),
+    ('Вт-Чт-Сб 9:00-18:00', {1, 3, 5}, (540, 1080)),
+    ('Пн-Пт 10:00-19:00', {0, 1, 2, 3, 4}, (600, 1140)),
+])
+def test_seed_formats(text, days, hours):
+    assert parse_schedule(text) == (days, hours)
+
+
+def test_comma_list():
+    assert parse_schedule('Вт, Чт, Сб 9:00-15:00') == ({1, 3, 5}, (540, 900))
+
+
+def test_two_days_with_comma_are_not_a_range():
+    assert parse_schedule('Пн, Ср')[0] == {0, 2}
+    assert parse_schedule('Пн-Ср')[0] == {0, 1, 2}
+
+
+def test_range_and_list_combined():
+    # Пример из формы регистрации сотрудника
+    days, hours = parse_schedule('Пн-Пт 9:00-18:00, Сб 10:00-16:00')
+    assert days == {0, 1, 2, 3, 4, 5}
+    assert hours == (540, 1080)
+
+
+def test_range_through_sunday():
+    assert parse_schedule('Пт-Пн')[0] == {4, 5, 6, 0}
+
+
+def test_empty():
+    assert parse_schedule(None) == (set(), None)
+    assert parse_schedule('по записи') == (set(), None)
@@ -0,0 +1,76 @@
+"""
+Рейтинг "популярно сейчас" с затуханием по времени
+
+Используется forward decay: просмотр в момент t добавляет к счету
+exp(k * (t - t0)), где t0 - фиксированная точка отсчета. Так счета всех
+статей сравнимы без пересчета, а счет статьи со временем только растет.
+Поэтому top-K можно поддерживать отсортированным списком из K элементов:
+статья попадает в топ только когда ее собственный счет обгоняет минимум.
+"""
+import bisect
+import math
+import threading
+import time
+
+
+class TrendingLeaderboard:
+    def __init__(self, half_life=24 * 3600, size=10):
+        self.decay = math.log(2) / half_life
+        self.size = size
+        self.loaded_at = None
+        self._origin = time.time()
+        self._scores = {}
+        self._meta = {}
+        self._top = []
+        self._lock = threading.Lock()
+
+    def _rebase(self, now):
+        """Переносит точку отсчета, чтобы экспонента не переполнилась"""
+        factor = math.exp(-self.decay * (now - self._origin))
+        self._scores = {item_id: score * factor for item_id, score in self._scores.items()
+                        if score * factor > 1e-9}
+        self._meta = {item_id: meta for item_id, meta in self._meta.items() if item_id in self._scores}
+        self._top = [(score * factor, item_id) for score, item_id in self._top if item_id in self._scores]
+        self._origin = now
+
+    def _record(self, item_id, count, now, meta):
+        if self.decay * (now - self._origin) > 50:
+            self._rebase(now)
+        old = self._scores.get(item_id)
+        new = (old or 0.0) + count * math.exp(self.decay * (now - self._origin))
+        self._scores[item_id] = new
+        if meta is not None:
+            self._meta[item_id] = meta
+
+        if old is not None:
+            position = bisect.bisect_left(self._top, (old, item_id))
+            if position < len(self._top) and self._top[position] == (old, item_id):
+                del self._top[position]
+        if len(self._top) < self.size or new > self._top[0][0]:
+            bisect.insort(self._top, (new, item_id))
+            if len(self._top) > self.size:
+                del self._top[0]
+
+    def record(self, item_id, count=1, now=None, meta=None):
+        """Учитывает просмотр(ы): O(log K) на поиск позиции в топе"""
+        with self._lock:
+            self._record(item_id, count, time.time() if now is None else now, meta)
+
+    def replace(self, events, now=None):
+        """Перестраивает рейтинг из событий (item_id, count, timestamp, meta)"""
+        with self._lock:
+            self._origin = time.time() if now is None else now
+            self._scores = {}
+            self._meta = {}
+            self._top = []
+            for item_id, count, timestamp, meta in events:
+                self._record(item_id, count, timestamp, meta)
+            self.loaded_at = time.time()
+
+    def top(self, limit=None, now=None):
+        """[(item_id, текущий счет, meta)] по убыванию счета"""
+        now = time.time() if now is None else now
+        with self._lock:
+            factor = math.exp(-self.decay * (now - self._origin))
+            items = list(reversed(self._top))[:limit or self.size]
+            return [(item_id, score * factor, self._meta.get(item_id)) for score, item_id in items]